@@ -0,0 +1,110 @@
+"""
+Pre-letterbox the SKU-110K training split into a single uint8 memmap.
+
+Every training image is decoded and letterboxed once, so training with
+USE_PRESTACK=1 reads ready-made CHW tensors instead of decoding and
+resizing multi-megapixel shelf photos every epoch.
+
+Writes to PRESTACK_DIR (default dataset/prestacked/):
+    sku110k_640.u8   raw uint8, shape (N, 3, 640, 640), RGB
+    labels_640.npy   float32 (M, 6): image index, class, cx, cy, w, h
+                     (normalized to the letterboxed canvas)
+    files_640.txt    source image path for each row
+
+Usage:
+    python dataset/prestack.py
+    IMG_SIZE=1024 python dataset/prestack.py
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+from ultralytics.data.utils import IMG_FORMATS, check_det_dataset, img2label_paths
+
+DATA_YAML = os.environ.get("DATA_YAML", "dataset/data.yaml")
+IMG_SIZE = int(os.environ.get("IMG_SIZE", "640"))
+PRESTACK_DIR = Path(os.environ.get("PRESTACK_DIR", "dataset/prestacked"))
+LETTERBOX_FILL = 114  # same grey as Ultralytics' LetterBox / inference/model.py
+
+
+def letterbox(path: str, out: np.ndarray, labels: np.ndarray) -> np.ndarray:
+    """Decode + centre-letterbox one image into `out` (3, S, S); remap its labels."""
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read image (missing or corrupt): {path}")
+    h, w = img.shape[:2]
+    ratio = IMG_SIZE / max(h, w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    pad_w, pad_h = (IMG_SIZE - new_w) // 2, (IMG_SIZE - new_h) // 2
+
+    canvas = np.full((IMG_SIZE, IMG_SIZE, 3), LETTERBOX_FILL, dtype=np.uint8)
+    canvas[pad_h:pad_h + new_h, pad_w:pad_w + new_w] = cv2.resize(
+        img, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+    )
+    out[:] = canvas[..., ::-1].transpose(2, 0, 1)  # BGR HWC → RGB CHW
+
+    # Normalized to the original image → normalized to the canvas
+    remapped = labels.copy()
+    remapped[:, 1] = (labels[:, 1] * new_w + pad_w) / IMG_SIZE
+    remapped[:, 2] = (labels[:, 2] * new_h + pad_h) / IMG_SIZE
+    remapped[:, 3] = labels[:, 3] * new_w / IMG_SIZE
+    remapped[:, 4] = labels[:, 4] * new_h / IMG_SIZE
+    return remapped
+
+
+def read_labels(path: str) -> np.ndarray:
+    """YOLO txt (cls cx cy w h per line) → float32 (n, 5); empty if missing."""
+    if not os.path.exists(path):
+        return np.zeros((0, 5), dtype=np.float32)
+    return np.loadtxt(path, dtype=np.float32, ndmin=2).reshape(-1, 5)
+
+
+def list_images(train: str | list[str]) -> list[str]:
+    """Image paths of a data.yaml `train` split: dirs and/or .txt lists, one or many."""
+    im_files = []
+    for path in map(Path, [train] if isinstance(train, (str, Path)) else train):
+        if path.is_dir():
+            im_files += (str(f) for f in path.rglob("*") if f.suffix[1:].lower() in IMG_FORMATS)
+        elif path.is_file():  # .txt list of image paths, relative to the list's dir
+            im_files += (
+                str(path.parent / line.strip()) for line in path.read_text().splitlines()
+                if line.strip()
+            )
+        else:
+            raise FileNotFoundError(f"Train split not found: {path}")
+    return sorted(im_files)
+
+
+def main():
+    im_files = list_images(check_det_dataset(DATA_YAML)["train"])
+    label_files = img2label_paths(im_files)
+    n = len(im_files)
+
+    PRESTACK_DIR.mkdir(parents=True, exist_ok=True)
+    images = np.memmap(
+        PRESTACK_DIR / f"sku110k_{IMG_SIZE}.u8",
+        dtype=np.uint8,
+        mode="w+",
+        shape=(n, 3, IMG_SIZE, IMG_SIZE),
+    )
+
+    def work(i: int) -> np.ndarray:
+        labels = letterbox(im_files[i], images[i], read_labels(label_files[i]))
+        return np.insert(labels, 0, i, axis=1)  # prepend the image index
+
+    # cv2 releases the GIL for decode / resize
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        targets = list(pool.map(work, range(n)))
+    images.flush()
+
+    np.save(PRESTACK_DIR / f"labels_{IMG_SIZE}.npy", np.concatenate(targets).astype(np.float32))
+    (PRESTACK_DIR / f"files_{IMG_SIZE}.txt").write_text("\n".join(im_files) + "\n")
+
+    print(f"✅ Prestacked {n} images ({images.nbytes / 1e9:.1f} GB) to: {PRESTACK_DIR}")
+
+
+if __name__ == "__main__":
+    main()
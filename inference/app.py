@@ -6,31 +6,48 @@ No PyTorch dependency — lightweight CPU-only deployment.
 Includes Prometheus metrics for observability.
 
 Optimizations:
-  - orjson for fast JSON serialization
+  - orjson for fast JSON serialization (numpy arrays serialized natively)
   - GZip middleware for compressed responses
   - Thread pool for non-blocking inference
+  - JPEG decode via OpenCV's libjpeg-turbo (SIMD IDCT / color conversion)
   - Model warmup on startup
+  - Content-addressed response cache (BLAKE2b of the upload) for re-submits
+  - uvloop event loop where installed (`--loop auto`; not on Windows) +
+    httptools parser (pinned on the uvicorn command line)
 
 Usage:
-    uvicorn inference.app:app --host 0.0.0.0 --port 8000
+    uvicorn inference.app:app --loop auto --http httptools \
+        --host 0.0.0.0 --port 8000 --workers 1
 
 Environment:
     WEIGHTS_PATH    Path to model weights (default: weights/best.onnx)
     CONF_THRESH     Confidence threshold (default: 0.25)
-    IMG_SIZE        Inference image size (default: 640)
+    IMG_SIZE        Inference image size (default: the model's input size)
     MODEL_NAME      Model name for metrics labels (default: yolo11l)
+    RESPONSE_CACHE_SIZE     Cached /predict responses keyed on image hash
+                            (default: 256, 0 disables)
+    INFERENCE_WORKERS       Concurrent inference threads (default: CPUs // 4, min 1)
+    INTRA_OP_THREADS        ORT threads per inference
+                            (default: CPUs // INFERENCE_WORKERS)
+    ORT_THREAD_AFFINITIES   Optional ORT intra-op pinning, e.g. "1;2;3"
+                            (one entry per intra-op thread minus one)
 """
 
 import asyncio
+import hashlib
 import io
 import logging
 import os
 import time
 import uuid
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from functools import partial
+from typing import Literal
 
+import cv2
+import numpy as np
 import orjson
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
@@ -62,12 +79,45 @@ logging.basicConfig(
 # ──────────────────────────────────────────────
 WEIGHTS_PATH = os.environ.get("WEIGHTS_PATH", "weights/best.onnx")
 CONFIDENCE_THRESHOLD = float(os.environ.get("CONF_THRESH", "0.25"))
-IMG_SIZE = int(os.environ.get("IMG_SIZE", "640"))
+IMG_SIZE = int(os.environ.get("IMG_SIZE", "0")) or None  # None → model's input size
 MAX_IMAGE_SIZE_MB = 10
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # read uploads 1MB at a time
 MODEL_NAME = os.environ.get("MODEL_NAME", "yolo11l")
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", "256"))
+
+# CPUs this process may run on. Honours cpuset / taskset pinning but not
+# CFS quotas (k8s CPU limits): under a limit, set INFERENCE_WORKERS /
+# INTRA_OP_THREADS explicitly.
+CPU_COUNT = (
+    len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity")
+    else os.cpu_count() or 2
+)
+
+
+def _positive_int_env(name: str, default: int) -> int:
+    """Read a thread / worker count from the environment; must be >= 1."""
+    value = int(os.environ.get(name, str(default)))
+    if value < 1:
+        raise ValueError(f"{name} must be >= 1, got {value}")
+    return value
+
 
-# Thread pool for CPU inference (prevents blocking the async event loop)
-_executor = ThreadPoolExecutor(max_workers=2)
+# Thread pool for CPU inference (prevents blocking the async event loop).
+# Workers first (~4 cores each), then every worker's ORT session gets an
+# equal share of the cores so none sit idle: e.g. 2 vCPU → 1 worker × 2
+# ORT threads, 6 vCPU → 1 × 6, 8 vCPU → 2 × 4, 10 vCPU → 2 × 5.
+INFERENCE_WORKERS = _positive_int_env("INFERENCE_WORKERS", max(1, CPU_COUNT // 4))
+INTRA_OP_THREADS = _positive_int_env(
+    "INTRA_OP_THREADS", max(1, CPU_COUNT // INFERENCE_WORKERS)
+)
+ORT_THREAD_AFFINITIES = os.environ.get("ORT_THREAD_AFFINITIES", "")
+_executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS)
+
+# /predict payloads keyed on (image hash, params); LRU-evicted. Detections
+# are stored as serialized JSON (orjson.Fragment), so a hit only serializes
+# the small envelope (inference_ms=0, cached=true). Only touched from the
+# event loop, so no lock needed.
+_response_cache: OrderedDict[str, dict] = OrderedDict()
 
 # ──────────────────────────────────────────────
 # Prometheus Metrics
@@ -87,6 +137,10 @@ DETECTION_COUNT = Histogram(
     "Number of detections per image",
     buckets=[0, 10, 25, 50, 100, 150, 200, 300, 500],
 )
+CACHE_HITS = Counter(
+    "shelfwatch_response_cache_hits_total",
+    "Predict requests answered from the response cache",
+)
 IN_FLIGHT = Gauge(
     "shelfwatch_in_flight_requests",
     "Number of currently processing requests",
@@ -107,14 +161,21 @@ model_manager = ModelManager()
 async def lifespan(app: FastAPI):
     """Load model and warmup on startup."""
     logger.info("Loading model from %s", WEIGHTS_PATH)
-    model_manager.load(WEIGHTS_PATH)
+    model_manager.load(
+        WEIGHTS_PATH,
+        intra_op_threads=INTRA_OP_THREADS,
+        thread_affinities=ORT_THREAD_AFFINITIES,
+    )
     model_manager.warmup(imgsz=IMG_SIZE)
     MODEL_INFO.labels(
         model_name=MODEL_NAME,
         weights_path=WEIGHTS_PATH,
         runtime=model_manager.runtime,
     ).set(1)
-    logger.info("🚀 ShelfWatch inference ready (runtime=%s)", model_manager.runtime)
+    logger.info(
+        "🚀 ShelfWatch inference ready (runtime=%s, workers=%d)",
+        model_manager.runtime, INFERENCE_WORKERS,
+    )
     yield
     _executor.shutdown(wait=False)
     logger.info("Shutdown complete")
@@ -150,11 +211,59 @@ async def read_index():
 # ──────────────────────────────────────────────
 # JSON helper (orjson is ~10x faster than stdlib json)
 # ──────────────────────────────────────────────
+# Numpy arrays (columnar detections) are written straight from their buffers
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
 class ORJSONResponse(Response):
     media_type = "application/json"
 
     def render(self, content) -> bytes:
-        return orjson.dumps(content)
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+# ──────────────────────────────────────────────
+# Upload reading / image decoding
+# ──────────────────────────────────────────────
+async def _read_upload(upload: UploadFile, limit: int) -> bytearray | None:
+    """
+    Read an upload in chunks, bailing out with None once it exceeds `limit`.
+
+    Oversized files are rejected from the known size or the first chunk past
+    the limit, instead of being buffered whole into memory first.
+    """
+    if upload.size is not None and upload.size > limit:
+        return None
+    buf = bytearray()
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        buf.extend(chunk)
+        if len(buf) > limit:
+            return None
+    return buf
+
+
+def _decode_image(contents: bytes | bytearray, content_type: str) -> np.ndarray:
+    """
+    Decode an upload into an RGB uint8 HWC array.
+
+    JPEGs go through OpenCV's bundled libjpeg-turbo (SIMD IDCT + color
+    conversion); PNG / WebP stay on Pillow. EXIF orientation is ignored on
+    both paths, matching Pillow's default.
+
+    Raises Image.DecompressionBombError before any pixels are decoded when
+    the header declares more than Pillow's limit (2 × MAX_IMAGE_PIXELS).
+    OpenCV's own cap is 2^30 pixels, ~3 GB of BGR from a 10 MB upload.
+    """
+    header = Image.open(io.BytesIO(contents))  # lazy: parses the header only
+    if content_type == "image/jpeg":
+        bgr = cv2.imdecode(
+            np.frombuffer(contents, dtype=np.uint8),
+            cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION,
+        )
+        if bgr is None:
+            raise ValueError("cv2.imdecode failed")
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    return np.asarray(header.convert("RGB"))
 
 
 # ──────────────────────────────────────────────
@@ -185,12 +294,21 @@ async def predict(
     request: Request,
     image: UploadFile = File(...),
     confidence: float = Query(default=None, ge=0.01, le=1.0),
+    layout: Literal["records", "columns"] = Query(default="records"),
+    cache: bool = Query(default=True),
 ):
     """
     Run dense product detection on an uploaded shelf image.
 
     Returns bounding boxes, confidence scores, class names,
     detection count, and inference latency.
+
+    `layout=columns` returns detections as parallel lists
+    ({"class": [...], "confidence": [...], "bbox": [...]}) — far fewer
+    objects to build and serialize for dense shelves.
+
+    Repeat uploads of the same image (retries, multiple clients) are served
+    from a content-addressed cache; pass `cache=false` to force inference.
     """
     request_id = request.headers.get("X-Request-ID", str(uuid.uuid4())[:8])
     IN_FLIGHT.inc()
@@ -203,13 +321,35 @@ async def predict(
             REQUEST_COUNT.labels(status="error_format").inc()
             raise HTTPException(400, "Unsupported format. Use JPEG, PNG, or WebP.")
 
-        contents = await image.read()
-        if len(contents) > MAX_IMAGE_SIZE_MB * 1024 * 1024:
+        contents = await _read_upload(image, MAX_IMAGE_SIZE_MB * 1024 * 1024)
+        if contents is None:
             REQUEST_COUNT.labels(status="error_size").inc()
             raise HTTPException(400, f"Image exceeds {MAX_IMAGE_SIZE_MB}MB limit.")
 
+        # ── Response cache (skips decode, preprocess and inference) ──
+        cache_key = None
+        if cache and RESPONSE_CACHE_SIZE > 0:
+            digest = hashlib.blake2b(contents, digest_size=16).hexdigest()
+            cache_key = f"{digest}:{conf}:{layout}"
+            cached = _response_cache.get(cache_key)
+            if cached is not None:
+                _response_cache.move_to_end(cache_key)
+                CACHE_HITS.inc()
+                REQUEST_COUNT.labels(status="success").inc()
+                logger.info("req=%s cache hit", request_id)
+                body = orjson.dumps(
+                    {**cached, "inference_ms": 0.0, "cached": True},
+                    option=ORJSON_OPTIONS,
+                )
+                return Response(
+                    content=body, media_type="application/json", headers={"X-Cache": "HIT"}
+                )
+
         try:
-            img = Image.open(io.BytesIO(contents)).convert("RGB")
+            img = _decode_image(contents, image.content_type)
+        except Image.DecompressionBombError:
+            REQUEST_COUNT.labels(status="error_size").inc()
+            raise HTTPException(400, "Image dimensions exceed the pixel limit.")
         except Exception:
             REQUEST_COUNT.labels(status="error_decode").inc()
             raise HTTPException(400, "Could not decode image.")
@@ -217,30 +357,46 @@ async def predict(
         # ── Inference (in thread pool to not block event loop) ──
         loop = asyncio.get_running_loop()
         start = time.perf_counter()
+        columnar = layout == "columns"
         detections = await loop.run_in_executor(
             _executor,
-            partial(model_manager.predict, img, imgsz=IMG_SIZE, conf=conf),
+            partial(
+                model_manager.predict, img, imgsz=IMG_SIZE, conf=conf, columnar=columnar
+            ),
         )
         latency = time.perf_counter() - start
+        count = len(detections["confidence"]) if columnar else len(detections)
+        height, width = img.shape[:2]
 
         logger.info(
             "req=%s detections=%d latency=%.1fms size=%dx%d",
-            request_id, len(detections), latency * 1000, img.width, img.height,
+            request_id, count, latency * 1000, width, height,
         )
 
         # ── Record metrics ──
         INFERENCE_LATENCY.observe(latency)
-        DETECTION_COUNT.observe(len(detections))
+        DETECTION_COUNT.observe(count)
         REQUEST_COUNT.labels(status="success").inc()
 
-        return {
-            "detections": detections,
-            "count": len(detections),
+        payload = {
+            # Serialized once; embedded verbatim here and in cache hits
+            "detections": orjson.Fragment(orjson.dumps(detections, option=ORJSON_OPTIONS)),
+            "count": count,
             "inference_ms": round(latency * 1000, 2),
-            "image_size": {"width": img.width, "height": img.height},
+            "cached": False,
+            "image_size": {"width": width, "height": height},
             "model": MODEL_NAME,
             "runtime": model_manager.runtime,
         }
+        body = orjson.dumps(payload, option=ORJSON_OPTIONS)
+        if cache_key is not None:
+            _response_cache[cache_key] = payload
+            if len(_response_cache) > RESPONSE_CACHE_SIZE:
+                _response_cache.popitem(last=False)
+
+        return Response(
+            content=body, media_type="application/json", headers={"X-Cache": "MISS"}
+        )
 
     except HTTPException:
         raise
@@ -9,12 +9,57 @@ Optimizations:
   - Memory pattern optimization
   - Tuned thread count for m7i-flex (2 vCPU)
   - Pre-allocated numpy buffers for preprocessing
+  - IOBinding onto those buffers (no per-request input/output copies)
+  - Fused cast + normalize + HWC→CHW pack into a reused NCHW buffer
+    (Numba-parallel when available)
+    (or skipped entirely for models exported with in-graph preprocessing)
+  - OpenCV SIMD (SSE4/AVX2) letterbox resize
+  - OpenCV C++ NMS
 """
 
+import threading
+from collections import OrderedDict
+
+import cv2
 import numpy as np
 import onnxruntime as ort
 from PIL import Image
 
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:  # optional — fall back to the numpy per-channel pack
+    njit = None
+else:
+    # _pack_nchw runs concurrently from every executor worker; Numba's
+    # fallback workqueue layer aborts the process on concurrent entry, so
+    # require TBB (requirements-inference.txt) or OpenMP
+    numba.config.THREADING_LAYER = "threadsafe"
+
+# Distinct input sizes whose preprocessing buffers each worker thread keeps
+MAX_CACHED_SIZES = 4
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _pack_nchw(canvas: np.ndarray, out: np.ndarray):
+        """uint8 HWC → normalized float32 NCHW; rows split across threads."""
+        height, width, channels = canvas.shape
+        scale = np.float32(1.0 / 255.0)
+        for y in prange(height):
+            for c in range(channels):
+                for x in range(width):
+                    out[0, c, y, x] = canvas[y, x, c] * scale
+
+else:
+
+    def _pack_nchw(canvas: np.ndarray, out: np.ndarray):
+        """uint8 HWC → normalized float32 NCHW; one fused pass per channel."""
+        scale = np.float32(1.0 / 255.0)
+        for c in range(canvas.shape[2]):
+            np.multiply(canvas[:, :, c], scale, out=out[0, c], dtype=np.float32)
+
 
 class ModelManager:
     """Lightweight ONNX-only inference manager."""
@@ -23,10 +68,20 @@ class ModelManager:
         self._session: ort.InferenceSession | None = None
         self._runtime = "none"
         self._input_name: str = ""
+        self._output_name: str = ""
+        self._output_shape: tuple[int, ...] | None = None
+        # Output layout, fixed at export: True = [1, 5, N] (Ultralytics
+        # default), False = [1, N, 5]; None = unknown, checked per call
+        self._channels_first: bool | None = None
+        # Input size the model was exported at; default `imgsz` for predict
         self._imgsz: int = 640
+        self._intra_op_threads: int | None = None  # caps Numba's pack threads too
+        # True for models exported with preprocessing fused in (uint8 NHWC input)
+        self._uint8_input: bool = False
         self._class_names: list[str] = ["objects"]  # SKU-110K single class
-        # Pre-allocated canvas for preprocessing (reuse across requests)
-        self._canvas: np.ndarray | None = None
+        # Per-thread canvas, input/output buffers + IOBindings, reused across
+        # requests (executor workers run concurrently)
+        self._local = threading.local()
 
     @property
     def is_loaded(self) -> bool:
@@ -36,8 +91,19 @@ class ModelManager:
     def runtime(self) -> str:
         return self._runtime
 
-    def load(self, weights_path: str):
-        """Load ONNX model with optimized CPU session options."""
+    def load(
+        self,
+        weights_path: str,
+        intra_op_threads: int | None = None,
+        thread_affinities: str = "",
+    ):
+        """
+        Load ONNX model with optimized CPU session options.
+
+        `intra_op_threads` defaults to all CPUs; lower it when several
+        requests run concurrently. `thread_affinities` is passed through to
+        ORT's `session.intra_op_thread_affinities` to pin intra-op threads.
+        """
         import os
 
         if not os.path.exists(weights_path):
@@ -55,10 +121,14 @@ class ModelManager:
 
         # ── Thread tuning for m7i-flex.large (2 vCPU) ──
         # intra = parallelism within a single op (matmul, conv)
-        # inter = parallelism across independent ops
-        cpu_count = os.cpu_count() or 2
-        sess_options.intra_op_num_threads = cpu_count
-        sess_options.inter_op_num_threads = max(1, cpu_count // 2)
+        # inter = parallelism across independent ops (unused when sequential)
+        sess_options.intra_op_num_threads = intra_op_threads or os.cpu_count() or 2
+        self._intra_op_threads = sess_options.intra_op_num_threads
+        sess_options.inter_op_num_threads = 1
+        if thread_affinities:
+            sess_options.add_session_config_entry(
+                "session.intra_op_thread_affinities", thread_affinities
+            )
 
         # ── Execution mode ──
         sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
@@ -72,10 +142,22 @@ class ModelManager:
         # Cache input metadata
         input_meta = self._session.get_inputs()[0]
         self._input_name = input_meta.name
-        self._imgsz = input_meta.shape[-1] if input_meta.shape[-1] else 640
-
-        # Pre-allocate canvas
-        self._canvas = np.full((self._imgsz, self._imgsz, 3), 114, dtype=np.uint8)
+        self._uint8_input = input_meta.type == "tensor(uint8)"
+        size = input_meta.shape[1] if self._uint8_input else input_meta.shape[-1]
+        self._imgsz = size if isinstance(size, int) else 640
+
+        # Cache output metadata (static shape → bind a pre-allocated buffer)
+        output_meta = self._session.get_outputs()[0]
+        self._output_name = output_meta.name
+        self._output_shape = (
+            tuple(output_meta.shape)
+            if all(isinstance(d, int) for d in output_meta.shape) else None
+        )
+        self._channels_first = (
+            self._output_shape[1] < self._output_shape[2]
+            if self._output_shape is not None else None
+        )
+        self._local = threading.local()
 
         self._runtime = "onnx-cpu"
 
@@ -84,50 +166,69 @@ class ModelManager:
         print(f"   Threads: intra={sess_options.intra_op_num_threads}, "
               f"inter={sess_options.inter_op_num_threads}")
         print(f"   Providers: {self._session.get_providers()}")
+        print(f"   CPU int8 ISA: {', '.join(_int8_isa_flags()) or 'baseline'}")
 
-    def warmup(self, imgsz: int = 640):
+    def warmup(self, imgsz: int | None = None):
         """Run a dummy inference to warm up the model (JIT, memory allocation)."""
         if not self.is_loaded:
             return
+        imgsz = imgsz or self._imgsz
         dummy = Image.new("RGB", (imgsz, imgsz), color=(114, 114, 114))
         self.predict(dummy, imgsz=imgsz, conf=0.99)
         print("✅ Model warmed up")
 
     def predict(
         self,
-        image: Image.Image,
-        imgsz: int = 640,
+        image: Image.Image | np.ndarray,
+        imgsz: int | None = None,
         conf: float = 0.25,
-    ) -> list[dict]:
+        columnar: bool = False,
+    ) -> list[dict] | dict[str, list | np.ndarray]:
         """
         Run inference and return parsed detections.
 
+        `image` is a PIL image or an RGB uint8 HWC array. `imgsz` defaults
+        to the model's own input size.
+        `columnar=True` returns one column per field ({"class", "confidence",
+        "bbox"}) instead of one dict per detection; confidence / bbox stay
+        float32 numpy arrays for orjson's OPT_SERIALIZE_NUMPY.
         Preprocessing: letterbox resize → normalize → NCHW
         Postprocessing: confidence filter → NMS → scale boxes back
         """
         if not self.is_loaded:
             raise RuntimeError("Model not loaded. Call load() first.")
 
-        orig_w, orig_h = image.size
+        imgsz = imgsz or self._imgsz
+        pixels = np.asarray(image)
+        orig_h, orig_w = pixels.shape[:2]
 
         # ── Preprocess ──
-        img_array, ratio, pad_w, pad_h = self._preprocess(image, imgsz)
+        img_array, ratio, pad_w, pad_h = self._preprocess(pixels, imgsz)
 
-        # ── Inference ──
-        outputs = self._session.run(None, {self._input_name: img_array})
+        # ── Inference (ORT reads/writes our buffers in place) ──
+        binding, output = self._io_binding(img_array)
+        self._session.run_with_iobinding(binding)
+        if output is None:
+            output = binding.copy_outputs_to_cpu()[0]
 
         # ── Postprocess ──
         detections = self._postprocess(
-            outputs[0], conf, orig_w, orig_h, ratio, pad_w, pad_h
+            output, conf, orig_w, orig_h, ratio, pad_w, pad_h, columnar
         )
 
         return detections
 
     def _preprocess(
-        self, image: Image.Image, imgsz: int
+        self, image: Image.Image | np.ndarray, imgsz: int
     ) -> tuple[np.ndarray, float, float, float]:
-        """Letterbox resize, normalize, convert to NCHW float32."""
-        orig_w, orig_h = image.size
+        """
+        Letterbox resize, normalize, convert to NCHW float32.
+
+        Models with in-graph preprocessing get the uint8 canvas as-is
+        ([1, H, W, 3], zero-copy view).
+        """
+        pixels = np.asarray(image)
+        orig_h, orig_w = pixels.shape[:2]
 
         # Calculate letterbox resize
         ratio = min(imgsz / orig_w, imgsz / orig_h)
@@ -136,26 +237,96 @@ class ModelManager:
         pad_w = (imgsz - new_w) / 2
         pad_h = (imgsz - new_h) / 2
 
-        # Resize image
-        resized = image.resize((new_w, new_h), Image.BILINEAR)
+        # Resize image (cv2.resize dispatches to SSE4/AVX2 kernels)
+        resized = cv2.resize(
+            pixels, (new_w, new_h), interpolation=cv2.INTER_LINEAR
+        )
 
-        # Reuse pre-allocated canvas (avoids allocation per request)
-        canvas = self._canvas.copy() if self._canvas is not None else \
-            np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+        # Reuse this thread's buffers in place (no per-request copy/alloc)
+        canvas, img_batch = self._buffers(imgsz)
 
         top = int(pad_h)
         left = int(pad_w)
-        canvas[top : top + new_h, left : left + new_w] = np.array(resized)
+        bottom = top + new_h
+        right = left + new_w
+        canvas[top:bottom, left:right] = resized
 
-        # Normalize + transpose in one step (HWC → CHW, uint8 → float32)
-        img_float = canvas.astype(np.float32, copy=False)
-        img_float *= (1.0 / 255.0)
-        img_batch = np.ascontiguousarray(
-            img_float.transpose(2, 0, 1)[np.newaxis, ...]
-        )
+        # Restore letterbox grey in the padding bands only; the previous
+        # request may have drawn there, the image region is overwritten anyway
+        canvas[:top].fill(114)
+        canvas[bottom:].fill(114)
+        canvas[top:bottom, :left].fill(114)
+        canvas[top:bottom, right:].fill(114)
+
+        if self._uint8_input:
+            return canvas[np.newaxis], ratio, pad_w, pad_h
+
+        # Fused cast + normalize + transpose straight into the contiguous
+        # NCHW buffer (no float HWC temp, no extra copy; Numba-parallel)
+        _pack_nchw(canvas, img_batch)
 
         return img_batch, ratio, pad_w, pad_h
 
+    def _buffers(self, imgsz: int) -> tuple[np.ndarray, np.ndarray | None]:
+        """
+        Return this thread's (canvas, NCHW float32) buffers for `imgsz`.
+
+        Cached per input size and LRU-bounded to MAX_CACHED_SIZES, so
+        alternating request sizes never re-allocate. The NCHW buffer is
+        None for uint8-input models, which consume the canvas directly.
+        """
+        cache = getattr(self._local, "buffers", None)
+        if cache is None:
+            cache = self._local.buffers = OrderedDict()
+            if njit is not None and self._intra_op_threads:
+                # Thread-local: this worker's pack shares its ORT thread
+                # budget instead of fanning out over every CPU
+                numba.set_num_threads(
+                    min(self._intra_op_threads, numba.config.NUMBA_NUM_THREADS)
+                )
+
+        entry = cache.get(imgsz)
+        if entry is None:
+            canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+            chw = None if self._uint8_input else \
+                np.empty((1, 3, imgsz, imgsz), dtype=np.float32)
+            entry = cache[imgsz] = (canvas, chw)
+            if len(cache) > MAX_CACHED_SIZES:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(imgsz)
+        return entry
+
+    def _io_binding(
+        self, img_array: np.ndarray
+    ) -> tuple[ort.IOBinding, np.ndarray | None]:
+        """
+        Bind `img_array` as input on this thread's IOBinding.
+
+        Returns the binding and the pre-allocated output buffer it writes to
+        (None when the output shape is dynamic and ORT allocates it).
+        """
+        local = self._local
+        binding = getattr(local, "binding", None)
+        if binding is None:
+            binding = self._session.io_binding()
+            local.output = None
+            if self._output_shape is not None:
+                local.output = np.empty(self._output_shape, dtype=np.float32)
+                binding.bind_output(
+                    self._output_name, "cpu", 0, np.float32,
+                    local.output.shape, local.output.ctypes.data,
+                )
+            else:
+                binding.bind_output(self._output_name, "cpu")
+            local.binding = binding
+
+        binding.bind_input(
+            self._input_name, "cpu", 0, img_array.dtype.type,
+            img_array.shape, img_array.ctypes.data,
+        )
+        return binding, local.output
+
     def _postprocess(
         self,
         output: np.ndarray,
@@ -165,23 +336,32 @@ class ModelManager:
         ratio: float,
         pad_w: float,
         pad_h: float,
-    ) -> list[dict]:
+        columnar: bool = False,
+    ) -> list[dict] | dict[str, list | np.ndarray]:
         """
         Parse YOLO ONNX output into detections.
 
         YOLO11 output shape: [1, 5, num_boxes] for single class
+        (or [1, num_boxes, 5] when exported with a trailing Transpose)
         where 5 = [x_center, y_center, width, height, class_conf]
         """
-        # Transpose if needed: [1, 5, N] → [1, N, 5]
-        if output.shape[1] < output.shape[2]:
-            output = output.transpose(0, 2, 1)
+        channels_first = self._channels_first
+        if channels_first is None:
+            channels_first = output.shape[1] < output.shape[2]
 
-        predictions = output[0]  # Remove batch dim → [N, 5]
+        # Remove batch dim → [N, 5] (a view for either layout)
+        predictions = output[0].T if channels_first else output[0]
 
         # ── Fast confidence filter (vectorized) ──
         scores = predictions[:, 4]
         mask = scores >= conf_thresh
         if not np.any(mask):
+            if columnar:
+                return {
+                    "class": [],
+                    "confidence": np.empty(0, dtype=np.float32),
+                    "bbox": np.empty((0, 4), dtype=np.float32),
+                }
             return []
 
         filtered = predictions[mask]
@@ -203,18 +383,32 @@ class ModelManager:
         final_scores = filtered_scores[keep]
 
         # ── Scale back to original image coordinates (vectorized) ──
-        boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad_w) / ratio, 0, orig_w)
-        boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad_h) / ratio, 0, orig_h)
+        # In place per column: no fancy-index gather/scatter temporaries
+        inv_ratio = 1.0 / ratio
+        for col, pad, limit in (
+            (0, pad_w, orig_w), (1, pad_h, orig_h), (2, pad_w, orig_w), (3, pad_h, orig_h)
+        ):
+            coord = boxes[:, col]
+            np.subtract(coord, pad, out=coord)
+            coord *= inv_ratio
+            np.clip(coord, 0, limit, out=coord)
 
-        # ── Build result list ──
         class_name = self._class_names[0]
-        detections = [
-            {
-                "class": class_name,
-                "confidence": round(float(final_scores[i]), 4),
-                "bbox": [round(float(c), 2) for c in boxes[i]],
+        if columnar:
+            # No Python floats at all: orjson serializes the arrays in C
+            return {
+                "class": [class_name] * len(final_scores),
+                "confidence": np.round(final_scores, 4),
+                "bbox": np.round(boxes, 2),
             }
-            for i in range(len(boxes))
+
+        # ── Build result list (round + convert in C, then zip) ──
+        # float64 first so tolist() yields e.g. 0.92, not 0.9200000166893005
+        scores_list = np.round(final_scores.astype(np.float64), 4).tolist()
+        boxes_list = np.round(boxes.astype(np.float64), 2).tolist()
+        detections = [
+            {"class": class_name, "confidence": score, "bbox": bbox}
+            for score, bbox in zip(scores_list, boxes_list)
         ]
 
         return detections
@@ -222,29 +416,19 @@ class ModelManager:
     @staticmethod
     def _nms(
         boxes: np.ndarray, scores: np.ndarray, iou_threshold: float = 0.45
-    ) -> list[int]:
-        """Non-Maximum Suppression (pure numpy, vectorized)."""
-        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
-        areas = (x2 - x1) * (y2 - y1)
-        order = scores.argsort()[::-1]
-
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(int(i))
-
-            if order.size == 1:
-                break
-
-            rest = order[1:]
-            xx1 = np.maximum(x1[i], x1[rest])
-            yy1 = np.maximum(y1[i], y1[rest])
-            xx2 = np.minimum(x2[i], x2[rest])
-            yy2 = np.minimum(y2[i], y2[rest])
-
-            intersection = np.maximum(0.0, xx2 - xx1) * np.maximum(0.0, yy2 - yy1)
-            iou = intersection / (areas[i] + areas[rest] - intersection)
-
-            order = rest[iou <= iou_threshold]
-
-        return keep
+    ) -> np.ndarray:
+        """Non-Maximum Suppression (OpenCV C++ kernel, no Python loop)."""
+        xywh = boxes.copy()
+        xywh[:, 2:] -= boxes[:, :2]  # xyxy → top-left xywh
+        keep = cv2.dnn.NMSBoxes(xywh, scores, 0.0, iou_threshold)
+        return np.asarray(keep, dtype=np.intp).reshape(-1)
+
+
+def _int8_isa_flags() -> list[str]:
+    """CPU features MLAS can use for int8 GEMM (Linux only, best-effort)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = next(line for line in f if line.startswith("flags")).split()
+    except (OSError, StopIteration):
+        return []
+    return [f for f in ("avx512_vnni", "avx_vnni", "amx_int8", "amx_bf16") if f in flags]
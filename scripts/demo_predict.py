@@ -72,7 +72,7 @@ def predict(image_path: str, confidence: float = 0.25):
 def main():
     if not check_health():
         print("\n⚠️  Start the API first:")
-        print("   uvicorn inference.app:app --host 0.0.0.0 --port 8000")
+        print("   uvicorn inference.app:app --loop auto --http httptools --host 0.0.0.0 --port 8000")
         sys.exit(1)
 
     if len(sys.argv) > 1:
@@ -1,38 +1,130 @@
 """
-Re-export YOLO model from .pt to FP32 ONNX, then quantize to INT8.
+Re-export YOLO model from .pt to FP32 ONNX, fuse input preprocessing into
+the graph, then quantize to INT8.
+
+The fused model takes the letterboxed uint8 NHWC canvas directly
+(Transpose → Cast → Mul(1/255) run inside ORT), so the server skips the
+float32 NCHW conversion entirely, and returns boxes as [1, N, 5].
+
+Quantization is static QDQ via `quantize_onnx.quantize`, calibrated on
+dataset/train/images through the fused uint8 input, so the Conv-heavy
+backbone runs as int8 QLinearConv rather than staying float. The weight /
+activation types and reduce_range are set (and explained) in quantize();
+the Detect head's elementwise tail stays FP32, and the result is checked
+against the FP32 model's confidences before it is kept.
 
 Usage:
     pip install ultralytics onnx onnxruntime
     python scripts/export_and_quantize.py
 """
 
-import os
-import time
-from onnxruntime.quantization import quantize_dynamic, QuantType
+import numpy as np
+import onnx
+import onnxruntime as ort
+from onnx import TensorProto, helper, numpy_helper
+from quantize_onnx import ShelfCalibrationReader, quantize
 from ultralytics import YOLO
 
+
+def fuse_preprocessing(model_path: str):
+    """Rewrite the model input from float32 NCHW to uint8 NHWC (in place)."""
+    model = onnx.load(model_path)
+    graph = model.graph
+    src = graph.input[0]
+    n, c, h, w = (d.dim_value for d in src.type.tensor_type.shape.dim)
+
+    # Re-point the original consumers at the normalized tensor
+    normalized = f"{src.name}_normalized"
+    for node in graph.node:
+        for i, name in enumerate(node.input):
+            if name == src.name:
+                node.input[i] = normalized
+
+    # Transpose while still uint8 (4x less data), then cast + scale
+    graph.initializer.append(
+        numpy_helper.from_array(np.array(1.0 / 255.0, dtype=np.float32), "preprocess_scale")
+    )
+    preprocess = [
+        helper.make_node("Transpose", [src.name], ["preprocess_nchw"], perm=[0, 3, 1, 2]),
+        helper.make_node("Cast", ["preprocess_nchw"], ["preprocess_float"], to=TensorProto.FLOAT),
+        helper.make_node("Mul", ["preprocess_float", "preprocess_scale"], [normalized]),
+    ]
+    for node in reversed(preprocess):
+        graph.node.insert(0, node)
+
+    graph.input.remove(src)
+    graph.input.insert(
+        0, helper.make_tensor_value_info(src.name, TensorProto.UINT8, [n, h, w, c])
+    )
+    onnx.checker.check_model(model)
+    onnx.save(model, model_path)
+
+
+def transpose_output(model_path: str):
+    """Append a Transpose so the output is [1, N, 5] (row per box) (in place)."""
+    model = onnx.load(model_path)
+    graph = model.graph
+    dst = graph.output[0]
+    n, c, boxes = (d.dim_value for d in dst.type.tensor_type.shape.dim)
+
+    channels_first = f"{dst.name}_channels_first"
+    for node in graph.node:
+        for i, name in enumerate(node.output):
+            if name == dst.name:
+                node.output[i] = channels_first
+    graph.node.append(
+        helper.make_node("Transpose", [channels_first], [dst.name], perm=[0, 2, 1])
+    )
+
+    graph.output.remove(dst)
+    graph.output.insert(
+        0, helper.make_tensor_value_info(dst.name, TensorProto.FLOAT, [n, boxes, c])
+    )
+    onnx.checker.check_model(model)
+    onnx.save(model, model_path)
+
+
+def check_scores(fp32_path: str, int8_path: str, image_dir: str, samples: int = 4,
+                 tolerance: float = 0.15):
+    """
+    Fail if the INT8 model's confidences drift from the FP32 model's.
+
+    The bound catches collapsed scores (e.g. a quantized head Concat
+    rounding every confidence to 0), not ordinary int8 noise.
+    """
+    graph = onnx.load(fp32_path, load_external_data=False).graph
+    reader = ShelfCalibrationReader(image_dir, graph, samples)
+    sessions = [
+        ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        for path in (fp32_path, int8_path)
+    ]
+    drift = 0.0
+    while (feed := reader.get_next()) is not None:
+        fp32, int8 = (session.run(None, feed)[0] for session in sessions)
+        drift = max(drift, float(np.abs(int8[..., 4] - fp32[..., 4]).max()))
+    if drift > tolerance:
+        raise RuntimeError(
+            f"INT8 confidences drift up to {drift:.3f} from FP32 (> {tolerance}); "
+            f"do not deploy {int8_path}"
+        )
+    print(f"✅ INT8 confidences within {drift:.3f} of FP32")
+
+
 # Step 1: Export FP32 ONNX (no half!)
 print("📦 Exporting best.pt → FP32 ONNX...")
 model = YOLO("weights/best.pt")
-model.export(format="onnx", imgsz=640, simplify=True, half=False)
+model.export(format="onnx", imgsz=640, simplify=True, half=False, opset=17)
 print("✅ Exported: weights/best.onnx (FP32)\n")
 
-# Step 2: Quantize to INT8
-input_path = "weights/best.onnx"
-output_path = "weights/best_int8.onnx"
-
-print("🔧 Quantizing FP32 → INT8...")
-print(f"   Input:  {input_path} ({os.path.getsize(input_path) / 1e6:.1f} MB)")
-
-start = time.perf_counter()
-quantize_dynamic(
-    model_input=input_path,
-    model_output=output_path,
-    weight_type=QuantType.QUInt8,
-)
-elapsed = time.perf_counter() - start
+# Step 2: Specialize graph I/O — fuse preprocessing (uint8 NHWC in →
+# normalized NCHW) and emit boxes row-major so the server never transposes
+fuse_preprocessing("weights/best.onnx")
+transpose_output("weights/best.onnx")
+print("✅ Fused preprocessing: input is now uint8 [1, 640, 640, 3]")
+print("✅ Transposed output: [1, N, 5]\n")
 
-print(f"✅ Output: {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
-print(f"   Took {elapsed:.1f}s")
-print(f"   Size reduction: {(1 - os.path.getsize(output_path) / os.path.getsize(input_path)) * 100:.0f}%")
+# Step 3: Static QDQ INT8, calibrated on the training images
+print("🔧 Quantizing FP32 → INT8 (static QDQ)...")
+quantize("weights/best.onnx", "weights/best_int8.onnx")
+check_scores("weights/best.onnx", "weights/best_int8.onnx", "dataset/train/images")
 print("\n💡 Set WEIGHTS_PATH=weights/best_int8.onnx in docker-compose.yml")
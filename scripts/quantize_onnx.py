@@ -1,22 +1,86 @@
 """
 ShelfWatch — ONNX INT8 Quantization Script
 
-Handles FP16 → FP32 conversion (if needed) then applies INT8 quantization.
-Typical speedup: 1.5–3x on Intel CPUs with VNNI support.
+Handles FP16 → FP32 conversion (if needed) then applies static (QDQ) INT8
+quantization calibrated on SKU-110K images. Static QDQ turns the Conv-heavy
+YOLO backbone into QLinearConv ops; dynamic quantization only touches MatMul.
+Typical speedup: 2–3x on Intel CPUs with VNNI support.
 
 Usage:
     python scripts/quantize_onnx.py
     python scripts/quantize_onnx.py --input weights/best.onnx --output weights/best_int8.onnx
+    python scripts/quantize_onnx.py --calib-dir dataset/valid/images --calib-size 16
+    python scripts/quantize_onnx.py --dynamic        # no calibration data available
 """
 
 import argparse
 import os
+import random
+import sys
 import time
+from pathlib import Path
 
 import numpy as np
 import onnx
 from onnx import numpy_helper, TensorProto
-from onnxruntime.quantization import quantize_dynamic, QuantType
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    CalibrationMethod,
+    QuantFormat,
+    QuantType,
+    quantize_dynamic,
+    quantize_static,
+)
+from PIL import Image
+
+# Repo root, so `inference` resolves when run as `python scripts/quantize_onnx.py`
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+class ShelfCalibrationReader(CalibrationDataReader):
+    """Feeds calibration images through the same letterbox preprocessing as serving."""
+
+    def __init__(self, image_dir: str, graph: onnx.GraphProto, limit: int = 32):
+        # Serving stack (cv2, numba) only needed for static calibration
+        from inference.model import ModelManager
+
+        paths = sorted(
+            p for p in Path(image_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS
+        )
+        if not paths:
+            raise FileNotFoundError(
+                f"No calibration images found in '{image_dir}'. "
+                "Download the dataset via `python dataset/download.py` or pass --dynamic."
+            )
+        paths = random.Random(0).sample(paths, min(limit, len(paths)))
+        print(f"📷 Calibrating on {len(paths)} images from {image_dir}")
+
+        # Match the graph's I/O layout the way ModelManager.load() does, so
+        # fused exports (uint8 NHWC in, [1, N, 5] out) get the raw canvas
+        graph_input = graph.input[0].type.tensor_type
+        uint8_input = graph_input.elem_type == TensorProto.UINT8
+        size = graph_input.shape.dim[1 if uint8_input else -1].dim_value
+        out_dims = [d.dim_value for d in graph.output[0].type.tensor_type.shape.dim]
+
+        self._paths = iter(paths)
+        self._input_name = graph.input[0].name
+        self._imgsz = size or 640
+        self._preprocessor = ModelManager()
+        self._preprocessor._uint8_input = uint8_input
+        self._preprocessor._channels_first = (
+            out_dims[1] < out_dims[2] if len(out_dims) == 3 and all(out_dims) else None
+        )
+
+    def get_next(self) -> dict[str, np.ndarray] | None:
+        path = next(self._paths, None)
+        if path is None:
+            return None
+        with Image.open(path) as img:
+            batch, _, _, _ = self._preprocessor._preprocess(img.convert("RGB"), self._imgsz)
+        # The preprocessor reuses its input buffer; hand ORT an owned copy
+        return {self._input_name: batch.copy()}
 
 
 def convert_fp16_to_fp32(model_path: str, output_path: str) -> str:
@@ -62,8 +126,23 @@ def is_fp16_model(model_path: str) -> bool:
     return False
 
 
-def quantize(input_path: str, output_path: str):
-    """Apply dynamic INT8 quantization to an ONNX model."""
+def quantize(
+    input_path: str,
+    output_path: str,
+    calib_dir: str | None = "dataset/train/images",
+    calib_size: int = 32,
+):
+    """
+    Apply INT8 quantization to an ONNX model.
+
+    Uses static QDQ quantization calibrated on `calib_dir`; falls back to
+    dynamic quantization when `calib_dir` is None.
+
+    Percentile calibration keeps every image's activations in RAM until the
+    end (~280 MB per image for yolo11n @ 640, several times that for
+    yolo11l), so `calib_size` stays small. ORT's CalibMaxIntermediateOutputs
+    only applies to MinMax.
+    """
     print(f"📦 Input:  {input_path} ({os.path.getsize(input_path) / 1e6:.1f} MB)")
 
     # If FP16, convert to FP32 first
@@ -75,12 +154,42 @@ def quantize(input_path: str, output_path: str):
         quant_input = fp32_path
 
     # Quantize
+    # Signed weights × unsigned activations is the operand layout VNNI's
+    # VPDPBUSD consumes natively; reduce_range keeps the 7-bit weights safe
+    # from VPMADDUBSW saturation on pre-VNNI CPUs.
     start = time.perf_counter()
-    quantize_dynamic(
-        model_input=quant_input,
-        model_output=output_path,
-        weight_type=QuantType.QUInt8,
-    )
+    if calib_dir is None:
+        quantize_dynamic(
+            model_input=quant_input,
+            model_output=output_path,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            reduce_range=True,
+            extra_options={"WeightSymmetric": True, "ActivationSymmetric": False},
+        )
+    else:
+        graph = onnx.load(quant_input, load_external_data=False).graph
+        reader = ShelfCalibrationReader(calib_dir, graph, calib_size)
+        quantize_static(
+            model_input=quant_input,
+            model_output=output_path,
+            calibration_data_reader=reader,
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            reduce_range=True,
+            weight_type=QuantType.QInt8,
+            activation_type=QuantType.QUInt8,
+            # Only the compute-heavy ops. The Detect head's elementwise tail
+            # ends in a Concat of pixel boxes (0–640) and sigmoid scores
+            # (0–1); one uint8 scale there rounds every score to 0.
+            op_types_to_quantize=["Conv", "MatMul"],
+            calibrate_method=CalibrationMethod.Percentile,
+            extra_options={
+                "CalibPercentile": 99.999,
+                "WeightSymmetric": True,
+                "ActivationSymmetric": False,
+            },
+        )
     elapsed = time.perf_counter() - start
 
     # Cleanup temp FP32 file
@@ -97,8 +206,19 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Quantize ONNX model to INT8")
     parser.add_argument("--input", default="weights/best.onnx", help="Input ONNX model")
     parser.add_argument("--output", default="weights/best_int8.onnx", help="Output INT8 model")
+    parser.add_argument("--calib-dir", default="dataset/train/images",
+                        help="Directory of calibration images for static quantization")
+    parser.add_argument("--calib-size", type=int, default=32,
+                        help="Number of calibration images to sample (RAM grows per image)")
+    parser.add_argument("--dynamic", action="store_true",
+                        help="Use dynamic quantization (no calibration data needed)")
     args = parser.parse_args()
 
-    quantize(args.input, args.output)
+    quantize(
+        args.input,
+        args.output,
+        calib_dir=None if args.dynamic else args.calib_dir,
+        calib_size=args.calib_size,
+    )
     print("\n💡 Use the quantized model by setting:")
     print("   WEIGHTS_PATH=weights/best_int8.onnx")
@@ -1,11 +1,16 @@
 """ShelfWatch — Tests for the inference API."""
 
+import asyncio
 import io
 from unittest.mock import patch
 
+import numpy as np
+import orjson
 import pytest
+from fastapi import UploadFile
 from fastapi.testclient import TestClient
 from PIL import Image
+from prometheus_client import REGISTRY
 
 
 @pytest.fixture
@@ -27,15 +32,16 @@ def mock_model_manager():
 @pytest.fixture
 def client(mock_model_manager):
     """TestClient with mocked model."""
-    from inference.app import app
+    from inference.app import _response_cache, app
+    _response_cache.clear()
     return TestClient(app)
 
 
-def _make_test_image() -> bytes:
-    """Create a small JPEG in memory."""
-    img = Image.new("RGB", (100, 100), color="red")
+def _make_test_image(fmt: str = "JPEG", size: tuple[int, int] = (100, 100)) -> bytes:
+    """Create a small image in memory."""
+    img = Image.new("RGB", size, color="red")
     buf = io.BytesIO()
-    img.save(buf, format="JPEG")
+    img.save(buf, format=fmt)
     return buf.getvalue()
 
 
@@ -75,6 +81,113 @@ class TestPredictEndpoint:
         assert "inference_ms" in data
         assert "runtime" in data
 
+    def test_repeat_image_served_from_cache(self, client, mock_model_manager):
+        files = {"image": ("test.jpg", _make_test_image(), "image/jpeg")}
+        first = client.post("/predict", files=files)
+        second = client.post("/predict", files=files)
+        assert first.headers["X-Cache"] == "MISS"
+        assert second.headers["X-Cache"] == "HIT"
+        assert mock_model_manager.predict.call_count == 1
+
+        miss, hit = first.json(), second.json()
+        assert miss["cached"] is False
+        assert hit["cached"] is True
+        assert hit["inference_ms"] == 0
+        assert hit["detections"] == miss["detections"]
+        assert hit["count"] == miss["count"]
+
+        # Detections are cached as serialized JSON, not re-dumped per hit
+        from inference.app import _response_cache
+
+        (entry,) = _response_cache.values()
+        assert isinstance(entry["detections"], orjson.Fragment)
+
+    def test_cache_hit_counted_as_success(self, client):
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0.0
+
+        files = {"image": ("test.jpg", _make_test_image(), "image/jpeg")}
+        successes = sample("shelfwatch_requests_total", status="success")
+        hits = sample("shelfwatch_response_cache_hits_total")
+        client.post("/predict", files=files)
+        client.post("/predict", files=files)
+        assert sample("shelfwatch_requests_total", status="success") == successes + 2
+        assert sample("shelfwatch_response_cache_hits_total") == hits + 1
+
+    def test_cache_keyed_on_params_and_bypassable(self, client, mock_model_manager):
+        files = {"image": ("test.jpg", _make_test_image(), "image/jpeg")}
+        client.post("/predict", files=files)
+        client.post("/predict?confidence=0.5", files=files)
+        response = client.post("/predict?cache=false", files=files)
+        assert response.headers["X-Cache"] == "MISS"
+        assert mock_model_manager.predict.call_count == 3
+
+    def test_columnar_layout(self, client, mock_model_manager):
+        mock_model_manager.predict.return_value = {
+            "class": ["objects", "objects"],
+            "confidence": np.array([0.92, 0.81], dtype=np.float32),
+            "bbox": np.array(
+                [[100.0, 200.0, 300.0, 400.0], [1.0, 2.0, 3.0, 4.0]], dtype=np.float32
+            ),
+        }
+        response = client.post(
+            "/predict?layout=columns",
+            files={"image": ("test.jpg", _make_test_image(), "image/jpeg")},
+        )
+        assert response.status_code == 200
+        data = response.json()
+        assert data["count"] == 2
+        assert data["detections"]["confidence"] == [0.92, 0.81]
+        assert mock_model_manager.predict.call_args.kwargs["columnar"] is True
+
+    def test_rejects_unknown_layout(self, client):
+        response = client.post(
+            "/predict?layout=xml",
+            files={"image": ("test.jpg", _make_test_image(), "image/jpeg")},
+        )
+        assert response.status_code == 422
+
+    @pytest.mark.parametrize(
+        ("fmt", "content_type"), [("JPEG", "image/jpeg"), ("PNG", "image/png")]
+    )
+    def test_decodes_to_rgb_array(self, client, mock_model_manager, fmt, content_type):
+        image_data = _make_test_image(fmt, size=(120, 80))
+        response = client.post(
+            "/predict",
+            files={"image": ("test", image_data, content_type)},
+        )
+        assert response.status_code == 200
+        assert response.json()["image_size"] == {"width": 120, "height": 80}
+        pixels = mock_model_manager.predict.call_args.args[0]
+        assert pixels.shape == (80, 120, 3)
+        r, g, b = pixels[40, 60].astype(int)
+        assert r > 200 and g < 50 and b < 50
+
+    @pytest.mark.parametrize(
+        ("fmt", "content_type"), [("JPEG", "image/jpeg"), ("PNG", "image/png")]
+    )
+    def test_rejects_decompression_bomb_before_decode(
+        self, client, mock_model_manager, monkeypatch, fmt, content_type
+    ):
+        # 120 × 80 = 9600 px, over Pillow's hard limit of 2 × 1000
+        monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000)
+        with patch("inference.app.cv2.imdecode") as imdecode:
+            response = client.post(
+                "/predict",
+                files={"image": ("bomb", _make_test_image(fmt, size=(120, 80)), content_type)},
+            )
+        assert response.status_code == 400
+        assert "pixel limit" in response.json()["detail"]
+        imdecode.assert_not_called()
+        mock_model_manager.predict.assert_not_called()
+
+    def test_rejects_corrupt_image(self, client):
+        response = client.post(
+            "/predict",
+            files={"image": ("bad.jpg", b"not a jpeg", "image/jpeg")},
+        )
+        assert response.status_code == 400
+
     def test_rejects_unsupported_format(self, client):
         response = client.post(
             "/predict",
@@ -101,3 +214,25 @@ class TestPredictEndpoint:
         # Verify predict was called with custom confidence
         call_kwargs = mock_model_manager.predict.call_args
         assert call_kwargs.kwargs.get("conf") == 0.5 or call_kwargs[1].get("conf") == 0.5
+
+
+class TestReadUpload:
+    def test_reads_in_chunks_within_limit(self):
+        from inference.app import UPLOAD_CHUNK_SIZE, _read_upload
+
+        data = b"x" * (UPLOAD_CHUNK_SIZE + 10)
+        upload = UploadFile(io.BytesIO(data))
+        assert asyncio.run(_read_upload(upload, len(data))) == data
+
+    def test_stops_once_limit_exceeded(self):
+        from inference.app import _read_upload
+
+        upload = UploadFile(io.BytesIO(b"x" * 100))  # size unknown
+        assert asyncio.run(_read_upload(upload, 99)) is None
+
+    def test_rejects_known_size_without_reading(self):
+        from inference.app import _read_upload
+
+        upload = UploadFile(io.BytesIO(b"x" * 100), size=100)
+        assert asyncio.run(_read_upload(upload, 99)) is None
+        assert upload.file.tell() == 0
@@ -0,0 +1,195 @@
+"""ShelfWatch — Tests for the ONNX model manager (no weights required)."""
+
+import numpy as np
+import onnx
+import orjson
+import pytest
+from PIL import Image
+
+from inference.model import ModelManager
+
+
+@pytest.fixture
+def manager():
+    return ModelManager()
+
+
+class TestPreprocess:
+    def test_letterbox_shape_and_dtype(self, manager):
+        img = Image.new("RGB", (200, 100), color=(255, 0, 0))
+        batch, ratio, pad_w, pad_h = manager._preprocess(img, 64)
+        assert batch.shape == (1, 3, 64, 64)
+        assert batch.dtype == np.float32
+        assert ratio == pytest.approx(0.32)
+        assert pad_w == 0
+        assert pad_h == 16
+
+    def test_padding_and_normalization(self, manager):
+        img = Image.new("RGB", (200, 100), color=(255, 0, 0))
+        batch, _, _, _ = manager._preprocess(img, 64)
+        # Padding bands hold the letterbox grey (114)
+        assert np.allclose(batch[0, :, :16, :], 114 / 255)
+        assert np.allclose(batch[0, :, 48:, :], 114 / 255)
+        # Image region is normalized RGB
+        assert np.allclose(batch[0, 0, 16:48, :], 1.0)
+        assert np.allclose(batch[0, 1:, 16:48, :], 0.0)
+
+    def test_reuses_input_buffer(self, manager):
+        img = Image.new("RGB", (80, 60))
+        first, _, _, _ = manager._preprocess(img, 64)
+        second, _, _, _ = manager._preprocess(img, 64)
+        assert first is second
+        assert first.flags["C_CONTIGUOUS"]
+
+    def test_buffers_cached_per_size_with_lru_bound(self, manager):
+        from inference.model import MAX_CACHED_SIZES
+
+        img = Image.new("RGB", (80, 60))
+        first, _, _, _ = manager._preprocess(img, 32)
+        for size in range(64, 64 + 16 * (MAX_CACHED_SIZES - 1), 16):
+            manager._preprocess(img, size)
+        # Still cached: 32 is within the last MAX_CACHED_SIZES sizes
+        assert manager._preprocess(img, 32)[0] is first
+        for size in range(128, 128 + 16 * MAX_CACHED_SIZES, 16):
+            manager._preprocess(img, size)
+        # Evicted by the newer sizes
+        assert manager._preprocess(img, 32)[0] is not first
+
+    def test_repads_canvas_between_requests(self, manager):
+        manager._preprocess(Image.new("RGB", (200, 100), color=(255, 0, 0)), 64)
+        batch, _, pad_w, _ = manager._preprocess(
+            Image.new("RGB", (100, 200), color=(0, 0, 255)), 64
+        )
+        assert pad_w == 16
+        # Bands left over from the landscape image are grey again
+        assert np.allclose(batch[0, :, :, :16], 114 / 255)
+        assert np.allclose(batch[0, :, :, 48:], 114 / 255)
+        assert np.allclose(batch[0, 2, :, 16:48], 1.0)
+
+    def test_concurrent_workers_pack_independently(self, manager):
+        from concurrent.futures import ThreadPoolExecutor
+
+        manager._intra_op_threads = 2
+        colors = [(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 0)]
+
+        def pack(color):
+            img = Image.new("RGB", (96, 96), color=color)
+            for _ in range(20):
+                batch, _, _, _ = manager._preprocess(img, 64)
+            return batch[0, :, 32, 32].copy()
+
+        with ThreadPoolExecutor(max_workers=len(colors)) as pool:
+            pixels = list(pool.map(pack, colors))
+        for pixel, color in zip(pixels, colors):
+            assert np.allclose(pixel, np.array(color) / 255)
+
+    def test_uint8_input_model_gets_raw_canvas(self, manager):
+        manager._uint8_input = True
+        img = Image.new("RGB", (200, 100), color=(255, 0, 0))
+        batch, _, _, _ = manager._preprocess(img, 64)
+        assert batch.shape == (1, 64, 64, 3)
+        assert batch.dtype == np.uint8
+        assert (batch[0, :16] == 114).all()
+        assert (batch[0, 16:48] == (255, 0, 0)).all()
+
+
+class TestNMS:
+    def test_suppresses_overlapping_boxes(self):
+        boxes = np.array(
+            [[0, 0, 10, 10], [1, 1, 11, 11], [50, 50, 60, 60]], dtype=np.float32
+        )
+        scores = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+        keep = ModelManager._nms(boxes, scores, iou_threshold=0.45)
+        assert keep.tolist() == [1, 2]
+
+    def test_keeps_boxes_below_threshold(self):
+        boxes = np.array([[0, 0, 10, 10], [5, 0, 15, 10]], dtype=np.float32)
+        scores = np.array([0.9, 0.8], dtype=np.float32)
+        # IoU = 50 / 150 ≈ 0.33
+        keep = ModelManager._nms(boxes, scores, iou_threshold=0.45)
+        assert keep.tolist() == [0, 1]
+
+
+class TestPostprocess:
+    @staticmethod
+    def _raw_output(rows: list[list[float]]) -> np.ndarray:
+        """YOLO11 layout: [1, 5, N] with rows of (cx, cy, w, h, conf)."""
+        padded = rows + [[0, 0, 0, 0, 0]] * 8  # real outputs have N >> 5
+        return np.array(padded, dtype=np.float32).T[np.newaxis]
+
+    def test_scales_boxes_and_rounds(self, manager):
+        output = self._raw_output([
+            [32, 32, 20, 10, 0.91234567],
+            [10, 10, 4, 4, 0.1],  # below threshold
+        ])
+        dets = manager._postprocess(output, 0.25, 200, 100, 0.32, 0.0, 16.0)
+        assert dets == [
+            {"class": "objects", "confidence": 0.9123, "bbox": [68.75, 34.38, 131.25, 65.62]}
+        ]
+
+    def test_clips_to_image_bounds(self, manager):
+        output = self._raw_output([[2, 20, 10, 10, 0.9]])
+        dets = manager._postprocess(output, 0.25, 200, 100, 0.32, 0.0, 16.0)
+        assert dets[0]["bbox"][0] == 0.0
+
+    def test_columnar_layout(self, manager):
+        output = self._raw_output([[32, 32, 20, 10, 0.91234567], [200, 200, 4, 4, 0.5]])
+        dets = manager._postprocess(
+            output, 0.25, 200, 100, 0.32, 0.0, 16.0, columnar=True
+        )
+        assert isinstance(dets["confidence"], np.ndarray)
+        payload = orjson.loads(orjson.dumps(dets, option=orjson.OPT_SERIALIZE_NUMPY))
+        assert payload["class"] == ["objects", "objects"]
+        assert payload["confidence"] == [0.9123, 0.5]
+        assert payload["bbox"][0] == [68.75, 34.38, 131.25, 65.62]
+
+    def test_row_major_output_layout(self, manager):
+        manager._channels_first = False  # set by load() from the output shape
+        output = np.array([[[32, 32, 20, 10, 0.9]]], dtype=np.float32)  # [1, 1, 5]
+        dets = manager._postprocess(output, 0.25, 200, 100, 0.32, 0.0, 16.0)
+        assert dets[0]["bbox"] == [68.75, 34.38, 131.25, 65.62]
+
+    def test_no_detections(self, manager):
+        output = self._raw_output([[32, 32, 20, 10, 0.1]])
+        assert manager._postprocess(output, 0.25, 200, 100, 0.32, 0.0, 16.0) == []
+        dets = manager._postprocess(
+            output, 0.25, 200, 100, 0.32, 0.0, 16.0, columnar=True
+        )
+        payload = orjson.loads(orjson.dumps(dets, option=orjson.OPT_SERIALIZE_NUMPY))
+        assert payload == {"class": [], "confidence": [], "bbox": []}
+
+
+class TestLoadedModel:
+    @pytest.fixture
+    def model_path(self, tmp_path):
+        """Float NCHW Conv model with a static 32 px input, [1, 5, N] output."""
+        from onnx import TensorProto, helper, numpy_helper
+
+        weights = np.random.default_rng(0).standard_normal((5, 3, 3, 3)).astype(np.float32)
+        graph = helper.make_graph(
+            [
+                helper.make_node("Conv", ["images", "w"], ["conv"], pads=[1, 1, 1, 1]),
+                helper.make_node("Reshape", ["conv", "shape"], ["output0"]),
+            ],
+            "tiny",
+            [helper.make_tensor_value_info("images", TensorProto.FLOAT, [1, 3, 32, 32])],
+            [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, 5, 1024])],
+            [
+                numpy_helper.from_array(weights, "w"),
+                numpy_helper.from_array(np.array([1, 5, -1], dtype=np.int64), "shape"),
+            ],
+        )
+        path = tmp_path / "tiny.onnx"
+        onnx.save(
+            helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8),
+            path,
+        )
+        return str(path)
+
+    def test_defaults_to_model_input_size(self, manager, model_path):
+        manager.load(model_path, intra_op_threads=1)
+        assert manager._imgsz == 32
+        manager.warmup()
+        manager.predict(Image.new("RGB", (200, 100)), conf=0.5)
+        # Only the model's own size was ever allocated
+        assert list(manager._local.buffers) == [32]
@@ -0,0 +1,89 @@
+"""ShelfWatch — Tests for the INT8 quantization script (tiny synthetic models)."""
+
+import numpy as np
+import onnx
+import onnxruntime as ort
+import pytest
+from onnx import TensorProto, helper, numpy_helper
+from PIL import Image
+
+from scripts.quantize_onnx import quantize
+
+IMGSZ = 32
+
+
+def _fused_model(path):
+    """
+    uint8 NHWC in → Transpose/Cast/Mul → Conv → Detect-like head → [1, N, 5].
+
+    Like YOLO's head, the final Concat joins pixel-scale boxes (0–640)
+    with sigmoid confidences (0–1).
+    """
+    rng = np.random.default_rng(0)
+    initializers = [
+        numpy_helper.from_array(np.array(1.0 / 255.0, dtype=np.float32), "scale"),
+        numpy_helper.from_array(rng.standard_normal((5, 3, 3, 3)).astype(np.float32), "w"),
+        numpy_helper.from_array(np.zeros(5, dtype=np.float32), "b"),
+        numpy_helper.from_array(np.array([1, 5, -1], dtype=np.int64), "shape"),
+        numpy_helper.from_array(np.array([4, 1], dtype=np.int64), "split"),
+        numpy_helper.from_array(np.array(640.0, dtype=np.float32), "box_scale"),
+    ]
+    nodes = [
+        helper.make_node("Transpose", ["images"], ["nchw"], perm=[0, 3, 1, 2]),
+        helper.make_node("Cast", ["nchw"], ["float"], to=TensorProto.FLOAT),
+        helper.make_node("Mul", ["float", "scale"], ["normalized"]),
+        helper.make_node("Conv", ["normalized", "w", "b"], ["conv"], pads=[1, 1, 1, 1]),
+        helper.make_node("Reshape", ["conv", "shape"], ["flat"]),
+        helper.make_node("Split", ["flat", "split"], ["box_logits", "cls_logits"], axis=1),
+        helper.make_node("Sigmoid", ["box_logits"], ["box_unit"]),
+        helper.make_node("Mul", ["box_unit", "box_scale"], ["boxes"]),
+        helper.make_node("Sigmoid", ["cls_logits"], ["scores"]),
+        helper.make_node("Concat", ["boxes", "scores"], ["channels_first"], axis=1),
+        helper.make_node("Transpose", ["channels_first"], ["output0"], perm=[0, 2, 1]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "fused",
+        [helper.make_tensor_value_info("images", TensorProto.UINT8, [1, IMGSZ, IMGSZ, 3])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, [1, IMGSZ * IMGSZ, 5])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+
+
+@pytest.fixture
+def calib_dir(tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    rng = np.random.default_rng(0)
+    for i in range(4):
+        pixels = rng.integers(0, 256, (24, 48, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(images / f"{i}.png")
+    return images
+
+
+def test_static_quantization_of_fused_model(tmp_path, calib_dir):
+    src, dst = tmp_path / "best.onnx", tmp_path / "best_int8.onnx"
+    _fused_model(src)
+
+    quantize(str(src), str(dst), calib_dir=str(calib_dir), calib_size=4)
+
+    quantized = onnx.load(dst)
+    assert any(node.op_type == "QuantizeLinear" for node in quantized.graph.node)
+    assert quantized.graph.input[0].type.tensor_type.elem_type == TensorProto.UINT8
+
+    rng = np.random.default_rng(1)
+    canvas = rng.integers(0, 256, (1, IMGSZ, IMGSZ, 3), dtype=np.uint8)
+    outputs = [
+        ort.InferenceSession(str(path), providers=["CPUExecutionProvider"]).run(
+            None, {"images": canvas}
+        )[0]
+        for path in (src, dst)
+    ]
+    fp32, int8 = outputs
+    assert int8.shape == (1, IMGSZ * IMGSZ, 5)
+    # Confidences must survive the head's Concat with pixel-scale boxes
+    assert fp32[..., 4].std() > 0.05
+    np.testing.assert_allclose(int8[..., 4], fp32[..., 4], atol=0.05)
@@ -0,0 +1,16 @@
+"""
+ShelfWatch — Training Process Bootstrap
+
+Imported by train.py ahead of mlflow / torch / Ultralytics. On a
+non-interactive stdout (CI / cluster logs) it turns off progress bars
+and per-step redraws, so metrics stream to MLflow instead. This must run
+before the Ultralytics import, which reads YOLO_VERBOSE only once.
+"""
+
+import os
+import sys
+
+INTERACTIVE = sys.stdout.isatty()
+if not INTERACTIVE:
+    os.environ.setdefault("YOLO_VERBOSE", "False")
+    os.environ.setdefault("TQDM_DISABLE", "1")  # plain tqdm bars (downloads)
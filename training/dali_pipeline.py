@@ -0,0 +1,227 @@
+"""
+ShelfWatch — DALI Training Input Pipeline
+
+GPU-side replacement for the Ultralytics training dataloader, enabled
+with USE_DALI=1 in train.py. JPEGs are decoded with nvJPEG and the
+crop / flip / HSV / letterbox augmentations run on the GPU, so CPU
+workers stop being the bottleneck on SKU-110K's dense 4K shelf photos.
+
+Batches use the same dict schema as YOLODataset.collate_fn (img,
+cls, bboxes, batch_idx, im_file, ...), so the stock DetectionTrainer
+loss and plotting code work unchanged. Validation keeps the regular
+Ultralytics loader.
+
+Note: mosaic / mixup have no DALI equivalent and are not applied;
+random_bbox_crop stands in as the scale/translate augmentation.
+
+Prerequisites:
+    pip install nvidia-dali-cuda120
+"""
+
+import numpy as np
+import torch
+from nvidia.dali import fn, pipeline_def, types
+from nvidia.dali.plugin.pytorch import DALIGenericIterator, LastBatchPolicy
+from ultralytics.models.yolo.detect import DetectionTrainer
+from ultralytics.utils.torch_utils import torch_distributed_zero_first
+
+LETTERBOX_FILL = 114  # same grey as Ultralytics' LetterBox / inference/model.py
+
+
+class ShelfSource:
+    """
+    Per-sample external source: this rank's shard of (jpeg bytes,
+    xyXY boxes, labels, index), reshuffled every epoch.
+
+    Doubles as the loader's `sampler` so the trainer can read the shard
+    length and call set_epoch() under DDP.
+    """
+
+    def __init__(self, dataset, batch_size: int, rank: int, world_size: int, seed: int):
+        self.im_files = dataset.im_files
+        self.labels = dataset.labels
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        # Whole batches only: a short final batch would stall the pipeline
+        shard = len(self.im_files) // world_size
+        self.length = shard // batch_size * batch_size
+        self._epoch = None
+        self._order = None
+
+    def __len__(self) -> int:
+        return self.length
+
+    def set_epoch(self, epoch: int):
+        """No-op: the shuffle follows DALI's own epoch_idx."""
+
+    def __call__(self, sample_info):
+        if sample_info.idx_in_epoch >= self.length:
+            raise StopIteration
+
+        if sample_info.epoch_idx != self._epoch:
+            # Same permutation on every rank, then each takes its stride
+            rng = np.random.default_rng(self.seed + sample_info.epoch_idx)
+            order = rng.permutation(len(self.im_files))
+            self._order = order[self.rank::self.world_size]
+            self._epoch = sample_info.epoch_idx
+
+        i = int(self._order[sample_info.idx_in_epoch])
+        label = self.labels[i]
+        xywh = label["bboxes"]  # normalized cx, cy, w, h
+        boxes = np.concatenate(
+            [xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1
+        ).clip(0.0, 1.0).astype(np.float32)
+
+        return (
+            np.fromfile(self.im_files[i], dtype=np.uint8),
+            boxes,
+            label["cls"].reshape(-1).astype(np.int32),
+            np.array([i], dtype=np.int64),
+        )
+
+
+@pipeline_def
+def shelf_pipeline(source: ShelfSource, imgsz: int, hyp):
+    """Decode → random bbox crop → flip → HSV → letterbox, all on the GPU."""
+    jpegs, boxes, labels, index = fn.external_source(
+        source=source,
+        num_outputs=4,
+        batch=False,
+        dtype=[types.UINT8, types.FLOAT, types.INT32, types.INT64],
+    )
+
+    crop_begin, crop_size, boxes, labels = fn.random_bbox_crop(
+        boxes,
+        labels,
+        bbox_layout="xyXY",
+        aspect_ratio=[0.5, 2.0],
+        thresholds=[0.1, 0.3, 0.5],
+        scaling=[1.0 - hyp.scale, 1.0],
+        allow_no_crop=True,
+        num_attempts=50,
+    )
+    # nvJPEG decodes only the crop window
+    images = fn.decoders.image_slice(
+        jpegs, crop_begin, crop_size, device="mixed", output_type=types.RGB
+    )
+
+    flip = fn.random.coin_flip(probability=hyp.fliplr)
+    images = fn.flip(images, horizontal=flip)
+    boxes = fn.bb_flip(boxes, ltrb=True, horizontal=flip)
+
+    images = fn.hsv(
+        images,
+        hue=fn.random.uniform(range=[-360 * hyp.hsv_h, 360 * hyp.hsv_h]),
+        saturation=fn.random.uniform(range=[1.0 - hyp.hsv_s, 1.0 + hyp.hsv_s]),
+        value=fn.random.uniform(range=[1.0 - hyp.hsv_v, 1.0 + hyp.hsv_v]),
+    )
+
+    # Letterbox: longest side → imgsz, pad right / bottom to a square
+    images = fn.resize(images, resize_longer=imgsz)
+    shape = fn.shapes(images, dtype=types.INT32)  # resized H, W, C
+    images = fn.crop(
+        images,
+        crop=(imgsz, imgsz),
+        crop_pos_x=0.0,
+        crop_pos_y=0.0,
+        out_of_bounds_policy="pad",
+        fill_values=LETTERBOX_FILL,
+    )
+    images = fn.transpose(images, perm=[2, 0, 1])  # HWC → CHW
+
+    # Ragged per-image boxes → dense batch; label -1 marks padding
+    boxes = fn.pad(boxes, axes=(0,), fill_value=0.0)
+    labels = fn.pad(labels, axes=(0,), fill_value=-1)
+    return images, boxes, labels, shape, index
+
+
+class DALILoader:
+    """Stands in for Ultralytics' InfiniteDataLoader inside the trainer loop."""
+
+    drop_last = True
+
+    def __init__(self, dataset, batch_size: int, imgsz: int, hyp, rank: int,
+                 world_size: int, device_id: int, num_threads: int, seed: int):
+        self.dataset = dataset  # labels for plots / close_mosaic; images are never loaded
+        self.batch_size = batch_size
+        self.imgsz = imgsz
+        self.num_workers = num_threads
+        self.sampler = ShelfSource(dataset, batch_size, max(rank, 0), world_size, seed)
+
+        pipe = shelf_pipeline(
+            self.sampler,
+            imgsz,
+            hyp,
+            batch_size=batch_size,
+            num_threads=num_threads,
+            device_id=device_id,
+            seed=seed + max(rank, 0),
+        )
+        pipe.build()
+        self._iterator = DALIGenericIterator(
+            pipe,
+            ["img", "boxes", "cls", "shape", "index"],
+            last_batch_policy=LastBatchPolicy.DROP,
+            auto_reset=True,
+        )
+
+    def __len__(self) -> int:
+        return len(self.sampler) // self.batch_size
+
+    def __iter__(self):
+        for (data,) in self._iterator:
+            yield self._to_batch(data)
+
+    def reset(self):
+        """No-op: there is no mosaic to turn off and DALI resets per epoch."""
+
+    def close(self):
+        self._iterator = None
+
+    def _to_batch(self, data: dict) -> dict:
+        """DALI outputs → the YOLODataset.collate_fn batch dict."""
+        labels = data["cls"]                      # (B, M), -1 padded
+        mask = labels >= 0
+        batch_idx = mask.nonzero(as_tuple=True)[0]
+
+        # Boxes are normalized to the crop; letterbox shrinks them by resized/imgsz
+        shape = data["shape"].to(labels.device)   # (B, 3): H, W, C
+        scale = (shape[:, [1, 0]].float() / self.imgsz)[batch_idx]
+        boxes = data["boxes"][mask]               # (n, 4) xyXY
+        xy = (boxes[:, :2] + boxes[:, 2:]) / 2 * scale
+        wh = (boxes[:, 2:] - boxes[:, :2]) * scale
+
+        index = data["index"].view(-1).tolist()
+        resized = [tuple(s) for s in shape[:, :2].tolist()]
+        return {
+            "img": data["img"],
+            "cls": labels[mask].float().unsqueeze(1),
+            "bboxes": torch.cat([xy, wh], dim=1),
+            "batch_idx": batch_idx.float(),
+            "im_file": [self.dataset.im_files[i] for i in index],
+            "ori_shape": [self.dataset.labels[i]["shape"] for i in index],
+            "resized_shape": resized,
+        }
+
+
+class DALIDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer whose training batches come from the DALI pipeline."""
+
+    def get_dataloader(self, dataset_path: str, batch_size: int = 16, rank: int = 0, mode: str = "train"):
+        if mode != "train":
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+
+        with torch_distributed_zero_first(rank):  # build the labels *.cache once under DDP
+            dataset = self.build_dataset(dataset_path, mode, batch_size)
+        return DALILoader(
+            dataset,
+            batch_size=batch_size,
+            imgsz=self.args.imgsz,
+            hyp=self.args,
+            rank=rank,
+            world_size=max(self.world_size, 1),
+            device_id=self.device.index or 0,
+            num_threads=max(self.args.workers, 1),
+            seed=self.args.seed,
+        )
@@ -0,0 +1,78 @@
+"""
+ShelfWatch — CUDA Batch Prefetcher
+
+Wraps the training dataloader so the next batch's host → device copy
+runs on a side stream while the current step's forward / backward runs
+on the default stream. Enabled with USE_PREFETCHER=1 in train.py; costs
+one extra batch of GPU memory.
+
+The wrapping happens in the trainer's get_dataloader, so loaders rebuilt
+mid-run (Ultralytics' OOM retry halves the batch and rebuilds the train
+pipeline) are prefetched too.
+"""
+
+import torch
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+
+class CUDAPrefetcher:
+    """Drop-in for the trainer's train_loader that yields device-resident batches."""
+
+    def __init__(self, loader, device: torch.device):
+        self.loader = loader
+        self.device = device
+        self.stream = torch.cuda.Stream(device)
+
+    def __getattr__(self, name):
+        # sampler / dataset / reset / close … → the wrapped loader
+        if name == "loader":  # not set yet (e.g. during copy) — avoid recursing
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __iter__(self):
+        pending = None
+        for batch in self.loader:
+            # Start copying batch i+1 before handing out batch i
+            ready = self._copy(batch)
+            if pending is not None:
+                yield self._claim(*pending)
+            pending = ready
+        if pending is not None:
+            yield self._claim(*pending)
+
+    def _copy(self, batch: dict) -> tuple[dict, torch.cuda.Event]:
+        """Issue the (pinned → device) copies on the side stream."""
+        with torch.cuda.stream(self.stream):
+            batch = {
+                k: v.to(self.device, non_blocking=True) if isinstance(v, torch.Tensor) else v
+                for k, v in batch.items()
+            }
+            copied = torch.cuda.Event()
+            copied.record(self.stream)
+        return batch, copied
+
+    def _claim(self, batch: dict, copied: torch.cuda.Event) -> dict:
+        """Make the compute stream wait for this batch's copy only, not the next one."""
+        compute = torch.cuda.current_stream(self.device)
+        compute.wait_event(copied)
+        for v in batch.values():
+            if isinstance(v, torch.Tensor):
+                v.record_stream(compute)  # don't recycle the memory until compute is done
+        return batch
+
+
+class PrefetchMixin:
+    """Trainer mixin: every train loader it builds comes wrapped in a CUDAPrefetcher."""
+
+    def get_dataloader(self, dataset_path: str, batch_size: int = 16, rank: int = 0, mode: str = "train"):
+        loader = super().get_dataloader(dataset_path, batch_size, rank, mode)
+        if mode == "train" and self.device.type == "cuda":
+            return CUDAPrefetcher(loader, self.device)
+        return loader
+
+
+class PrefetchDetectionTrainer(PrefetchMixin, DetectionTrainer):
+    """Stock DetectionTrainer with side-stream prefetched training batches."""
@@ -0,0 +1,108 @@
+"""
+ShelfWatch — Prestacked Training Dataset
+
+Reads the letterboxed uint8 memmap written by `dataset/prestack.py`
+instead of decoding and resizing JPEGs every epoch. Enabled with
+USE_PRESTACK=1 in train.py.
+
+Workers only slice the memmap (page cache after the first epoch); the
+pinned batch goes to the GPU with non_blocking=True, where horizontal
+flip and HSV jitter (kornia) run on the whole batch.
+
+Note: images are letterboxed once up front, so mosaic / random
+perspective are not applied in this mode. Validation keeps the regular
+Ultralytics loader.
+"""
+
+import os
+from pathlib import Path
+
+import kornia.augmentation as K
+import numpy as np
+import torch
+from prefetcher import PrefetchMixin
+from torch.utils.data import Dataset
+from ultralytics.data.build import build_dataloader
+from ultralytics.data.dataset import YOLODataset
+from ultralytics.models.yolo.detect import DetectionTrainer
+
+PRESTACK_DIR = Path(os.environ.get("PRESTACK_DIR", "dataset/prestacked"))
+
+
+class PrestackedDataset(Dataset):
+    """(N, 3, S, S) uint8 memmap + (M, 6) label table → YOLODataset-style samples."""
+
+    collate_fn = staticmethod(YOLODataset.collate_fn)
+
+    def __init__(self, root: Path, imgsz: int):
+        self.imgsz = imgsz
+        self.images = np.memmap(root / f"sku110k_{imgsz}.u8", dtype=np.uint8, mode="r")
+        self.images = self.images.reshape(-1, 3, imgsz, imgsz)
+        # One path per line, as prestack.py writes them (paths may hold spaces)
+        self.im_files = (root / f"files_{imgsz}.txt").read_text().splitlines()
+
+        # Rows are grouped by image index → per-image slices via offsets
+        targets = np.load(root / f"labels_{imgsz}.npy")
+        self.offsets = np.searchsorted(targets[:, 0], np.arange(len(self.images) + 1))
+        self.targets = targets[:, 1:]  # cls, cx, cy, w, h
+
+        # For DetectionTrainer.plot_training_labels
+        self.labels = [
+            {"cls": self.targets[a:b, :1], "bboxes": self.targets[a:b, 1:]}
+            for a, b in zip(self.offsets[:-1], self.offsets[1:])
+        ]
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __getitem__(self, i: int) -> dict:
+        target = self.targets[self.offsets[i]:self.offsets[i + 1]]
+        return {
+            "img": torch.from_numpy(np.array(self.images[i])),  # copy out of the memmap
+            "cls": torch.from_numpy(target[:, :1].copy()),
+            "bboxes": torch.from_numpy(target[:, 1:].copy()),
+            "batch_idx": torch.zeros(len(target)),
+            "im_file": self.im_files[i],
+            "ori_shape": (self.imgsz, self.imgsz),
+            "resized_shape": (self.imgsz, self.imgsz),
+        }
+
+
+class PrestackedDetectionTrainer(DetectionTrainer):
+    """DetectionTrainer fed from the prestacked memmap, augmenting on the GPU."""
+
+    def get_dataloader(self, dataset_path: str, batch_size: int = 16, rank: int = 0, mode: str = "train"):
+        if mode != "train":
+            return super().get_dataloader(dataset_path, batch_size, rank, mode)
+
+        return build_dataloader(
+            PrestackedDataset(PRESTACK_DIR, self.args.imgsz),
+            batch=batch_size,
+            workers=self.args.workers,
+            shuffle=True,
+            rank=rank,
+            device=self.device,
+        )
+
+    def preprocess_batch(self, batch: dict) -> dict:
+        batch = super().preprocess_batch(batch)  # → device, float [0, 1]
+        if not hasattr(self, "_color_jitter"):
+            self._color_jitter = K.ColorJiggle(
+                brightness=self.args.hsv_v,
+                saturation=self.args.hsv_s,
+                hue=self.args.hsv_h,
+                p=1.0,
+            ).to(self.device)
+
+        # Horizontal flip per image, mirroring the matching boxes' cx
+        flip = torch.rand(len(batch["img"]), device=self.device) < self.args.fliplr
+        batch["img"] = torch.where(flip[:, None, None, None], batch["img"].flip(-1), batch["img"])
+        box_flip = flip[batch["batch_idx"].long()]
+        batch["bboxes"][box_flip, 0] = 1.0 - batch["bboxes"][box_flip, 0]
+
+        batch["img"] = self._color_jitter(batch["img"])
+        return batch
+
+
+class PrefetchPrestackedTrainer(PrefetchMixin, PrestackedDetectionTrainer):
+    """PrestackedDetectionTrainer with side-stream prefetched training batches."""
@@ -5,73 +5,461 @@ Trains a YOLO11 model on the SKU-110K shelf dataset and logs
 metrics to MLflow.
 
 Usage:
-    python training/train.py
+    python training/train.py                          # all visible GPUs (DDP)
+    torchrun --nproc_per_node=4 training/train.py     # launch DDP ranks yourself
+    USE_DALI=1 python training/train.py               # GPU decode + augmentation
+    USE_PRESTACK=1 python training/train.py           # after dataset/prestack.py
+    USE_PREFETCHER=1 python training/train.py         # overlap H2D copies with compute
+    TORCH_COMPILE=0 python training/train.py          # eager, no torch.compile
+    EXPORT_TRT=1 python training/train.py             # + INT8/FP16 TensorRT engine
 
 Prerequisites:
     - Dataset downloaded via `python dataset/download.py`
     - MLflow server running (optional, defaults to local ./mlruns)
 """
 
+import contextlib
+import functools
+import hashlib
+import inspect
 import os
+import warnings
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import bootstrap  # quiets non-TTY output; must precede the Ultralytics import
 import mlflow
+import mlflow.pytorch
+import psutil
+import torch
 from ultralytics import YOLO
+from ultralytics.data.utils import IMG_FORMATS, check_det_dataset
+from ultralytics.utils.patches import torch_load
+
+# TF32 for the FP32 matmuls / convs that stay outside autocast (Ampere / Hopper)
+torch.set_float32_matmul_precision("high")  # sets torch.backends.cuda.matmul.allow_tf32
+torch.backends.cudnn.allow_tf32 = True
 
 
 # ──────────────────────────────────────────────
 # Config — adjust these as needed
 # ──────────────────────────────────────────────
-MODEL_VARIANT = os.environ.get("YOLO_MODEL", "yolo11l.pt")  # H100 → go large
-DATA_YAML = os.environ.get("DATA_YAML", "dataset/data.yaml")
-EPOCHS = int(os.environ.get("EPOCHS", "50"))
-IMG_SIZE = int(os.environ.get("IMG_SIZE", "640"))
-BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "32"))        # H100 can handle 32+
-PROJECT = "runs/shelf"
-NAME = "baseline"
+@dataclass(frozen=True, slots=True)
+class TrainCfg:
+    """
+    Training config, resolved from the environment once per process.
+
+    Fields carry no defaults: every default lives in get_cfg(), the one
+    place to adjust them.
+    """
+
+    model_variant: str
+    data_yaml: str
+    epochs: int
+    img_size: int
+    batch_size: int
+    # AutoBatch target: fraction of GPU memory to fill (single GPU only,
+    # 0 → use batch_size). Ultralytics probes the largest batch that fits.
+    batch_frac: float
+    # Nominal batch: gradients accumulate over max(1, round(nbs / batch))
+    # steps, so the effective batch stays ~nbs whatever fits in memory
+    nbs: int
+    # AdamW's elementwise update runs as one fused CUDA kernel (Ultralytics
+    # passes fused=True for Adam/AdamW on GPU). lr0 matches what
+    # optimizer="auto" picks for AdamW on a 1-class dataset.
+    optimizer: str
+    lr0: float
+    # Mixed precision: bf16 (no loss scaling, FP32 exponent range), fp16, or fp32
+    amp_dtype: str
+    # Multi-GPU: >1 GPU trains with DDP (one process per GPU, all-reduce
+    # overlapped with backward). Ultralytics spawns the ranks itself unless
+    # run under torchrun.
+    num_gpus: int
+    # Dataloader workers per rank (JPEG decode + augmentation run here). The
+    # Ultralytics loader already pins host memory, keeps its workers alive
+    # across epochs, prefetches 4 batches per worker and copies with
+    # non_blocking=True.
+    workers: int
+    # torch.compile (Inductor) mode: "default", "reduce-overhead" (CUDA graphs),
+    # "max-autotune-no-cudagraphs", or False for eager
+    compile: str | bool
+    # GPU input pipeline (nvJPEG decode + GPU augmentation), see dali_pipeline.py
+    dali: bool
+    # Copy batch i+1 to the GPU on a side stream during step i, see prefetcher.py
+    prefetcher: bool
+    # Read the letterboxed memmap from dataset/prestack.py, see prestacked.py
+    prestack: bool
+    # Post-train TensorRT INT8 engine (FP16 fallback), calibrated on a
+    # fraction of the training set
+    export_trt: bool
+    trt_calib_fraction: float
+    project: str
+    name: str
+
+    @property
+    def batch(self) -> int | float:
+        """AutoBatch fraction on one GPU; DDP needs a fixed global batch."""
+        distributed = self.num_gpus > 1 or int(os.environ.get("WORLD_SIZE", "1")) > 1
+        return self.batch_frac if self.batch_frac and not distributed else self.batch_size
+
+    @property
+    def device(self) -> list[int] | None:
+        """None → Ultralytics picks GPU 0 / CPU."""
+        return list(range(self.num_gpus)) if self.num_gpus > 1 else None
+
+
+def _compile_mode(value: str) -> str | bool:
+    """TORCH_COMPILE=0/false/off → eager, anything else is a torch.compile mode."""
+    return False if value.lower() in {"", "0", "false", "off"} else value
+
+
+@functools.cache
+def get_cfg() -> TrainCfg:
+    """Parse the environment overrides exactly once — adjust defaults here."""
+    env = os.environ.get
+    num_gpus = max(int(env("NGPU", str(torch.cuda.device_count()))), 1)
+    return TrainCfg(
+        model_variant=env("YOLO_MODEL", "yolo11l.pt"),  # H100 → go large
+        data_yaml=env("DATA_YAML", "dataset/data.yaml"),
+        epochs=int(env("EPOCHS", "50")),
+        img_size=int(env("IMG_SIZE", "640")),
+        batch_size=int(env("BATCH_SIZE", "32")),          # multi-GPU / BATCH_FRAC=0
+        batch_frac=float(env("BATCH_FRAC", "0.85")),
+        nbs=int(env("NBS", "64")),
+        optimizer=env("OPTIMIZER", "AdamW"),
+        lr0=float(env("LR0", "0.002")),
+        amp_dtype=env("AMP_DTYPE", "bf16"),
+        num_gpus=num_gpus,
+        workers=int(env("WORKERS", str(min(16, (os.cpu_count() or 1) // num_gpus)))),
+        compile=_compile_mode(env("TORCH_COMPILE", "default")),
+        dali=env("USE_DALI", "0") == "1",
+        prestack=env("USE_PRESTACK", "0") == "1",
+        prefetcher=env("USE_PREFETCHER", "0") == "1",
+        export_trt=env("EXPORT_TRT", "0") == "1",
+        trt_calib_fraction=float(env("TRT_CALIB_FRACTION", "0.1")),
+        project="runs/shelf",
+        name="baseline",
+    )
+
+
+RANK = int(os.environ.get("RANK", "0"))  # set per process by torchrun
+# Logged once at the end as mAP50, mAP50-95, precision, recall
+FINAL_METRICS = ("mAP50(B)", "mAP50-95(B)", "precision(B)", "recall(B)")
+
+
+def pick_cache_mode(cfg: TrainCfg) -> str:
+    """
+    Cache decoded images in RAM when they fit, else on disk (.npy per image).
+
+    Either way JPEG decode leaves the per-epoch path. Every DDP rank keeps
+    its own RAM cache, and we keep 50% headroom for workers / augmentation.
+    """
+    train_paths = check_det_dataset(cfg.data_yaml)["train"]
+    if isinstance(train_paths, (str, Path)):
+        train_paths = [train_paths]
+
+    n_images = 0
+    for path in map(Path, train_paths):
+        if path.is_dir():
+            n_images += sum(
+                1 for f in path.rglob("*") if f.suffix[1:].lower() in IMG_FORMATS
+            )
+        elif path.is_file():  # .txt list of image paths
+            n_images += sum(1 for line in path.read_text().splitlines() if line.strip())
+
+    needed = n_images * cfg.img_size * cfg.img_size * 3 * cfg.num_gpus
+    available = psutil.virtual_memory().available
+    return "ram" if needed * 1.5 < available else "disk"
+
+
+@contextlib.contextmanager
+def edge_convs_fp16():
+    """
+    Keep the first, second and last Conv in FP16 inside INT8 engine builds.
+
+    The stem convs see raw pixels and the last conv feeds box decoding —
+    the layers that lose the most mAP under INT8. Ultralytics builds the
+    engine itself, so we swap in a Builder that pins them right before
+    build_serialized_network.
+    """
+    try:
+        import tensorrt as trt
+    except ImportError:  # Ultralytics installs it on first export; pinning is skipped
+        warnings.warn(
+            "tensorrt not importable yet — building the engine without FP16 edge convs",
+            RuntimeWarning,
+            stacklevel=3,
+        )
+        yield
+        return
+
+    class Builder(trt.Builder):
+        def build_serialized_network(self, network, config):
+            int8 = getattr(trt.BuilderFlag, "INT8", None)  # gone in strongly-typed TRT 11
+            if int8 is not None and config.get_flag(int8):
+                convs = [
+                    layer for layer in map(network.get_layer, range(network.num_layers))
+                    if layer.type == trt.LayerType.CONVOLUTION
+                ]
+                for layer in {layer.name: layer for layer in convs[:2] + convs[-1:]}.values():
+                    layer.precision = trt.float16
+                    for i in range(layer.num_outputs):
+                        layer.set_output_type(i, trt.float16)
+                config.set_flag(trt.BuilderFlag.OBEY_PRECISION_CONSTRAINTS)
+            return super().build_serialized_network(network, config)
+
+    original = trt.Builder
+    trt.Builder = Builder
+    try:
+        yield
+    finally:
+        trt.Builder = original
+
+
+def export_engine(weights: str, cfg: TrainCfg) -> str:
+    """Export best.pt to a mixed INT8/FP16 TensorRT engine; returns its path."""
+    with edge_convs_fp16():
+        return YOLO(weights).export(
+            format="engine",
+            quantize=8,                        # INT8, other layers fall back to FP16
+            data=cfg.data_yaml,                # calibration images
+            fraction=cfg.trt_calib_fraction,
+            imgsz=cfg.img_size,
+            workspace=8,                       # GiB
+        )
+
+
+def enable_cudnn_benchmark(trainer):
+    """
+    Let cuDNN autotune conv algorithms for the (fixed) training shapes.
+
+    Turned on at on_pretrain_routine_end rather than at import because
+    AutoBatch refuses to probe with benchmark mode on.
+    """
+    torch.backends.cudnn.benchmark = True
+
+
+def channels_last_batches(trainer):
+    """
+    Hand the model NHWC images, matching its channels_last conv weights.
+
+    Ultralytics converts the model (channels_last=True) but not the batch;
+    without this the first conv relayouts the input on every step.
+    """
+    if trainer.device.type != "cuda":
+        return
+    preprocess = trainer.preprocess_batch
+
+    def preprocess_channels_last(batch: dict) -> dict:
+        batch = preprocess(batch)
+        batch["img"] = batch["img"].contiguous(memory_format=torch.channels_last)
+        return batch
+
+    trainer.preprocess_batch = preprocess_channels_last
+
+
+def drop_builtin_mlflow(trainer):
+    """
+    Remove Ultralytics' own MLflow integration from this trainer.
+
+    It would log every metric a second time (and may retarget the tracking
+    URI / experiment) and upload best.pt unconditionally at train end;
+    logging is owned by train() and log_epoch_metrics instead.
+    """
+    for event, funcs in trainer.callbacks.items():
+        trainer.callbacks[event] = [
+            f for f in funcs if f.__module__ != "ultralytics.utils.callbacks.mlflow"
+        ]
+
+
+def log_epoch_metrics(trainer):
+    """Stream losses, validation metrics and LR to MLflow after every epoch."""
+    if int(os.environ.get("RANK", "-1")) > 0:  # read at call time: also runs in DDP ranks
+        return
+    metrics = {
+        **trainer.label_loss_items(trainer.tloss, prefix="train"),
+        **trainer.metrics,
+    }
+    # MLflow metric names can't contain parentheses: metrics/mAP50(B) → metrics/mAP50B
+    metrics = {k.replace("(", "").replace(")", ""): float(v) for k, v in metrics.items()}
+    metrics["lr"] = trainer.optimizer.param_groups[0]["lr"]
+    mlflow.log_metrics(metrics, step=trainer.epoch)
+
+
+def build_model(cfg: TrainCfg) -> YOLO:
+    """Load the base weights and register the training callbacks."""
+    model = YOLO(cfg.model_variant)
+    model.add_callback("on_pretrain_routine_start", drop_builtin_mlflow)
+    model.add_callback("on_pretrain_routine_end", enable_cudnn_benchmark)
+    model.add_callback("on_pretrain_routine_end", channels_last_batches)
+    model.add_callback("on_fit_epoch_end", log_epoch_metrics)
+    return model
+
+
+def weights_digest(path: Path) -> str:
+    """
+    BLAKE2b-128 of a checkpoint's model tensors.
+
+    Not of the file: Ultralytics also stores a timestamp, train_args and
+    train_results in best.pt, so identical weights never match byte-wise.
+    """
+    ckpt = torch_load(path, map_location="cpu")
+    state = (ckpt.get("ema") or ckpt["model"]).state_dict()
+    h = hashlib.blake2b(digest_size=16)
+    for key in sorted(state):
+        tensor = state[key].detach().contiguous().reshape(-1)
+        h.update(f"{key}:{tensor.dtype}:{tuple(state[key].shape)}".encode())
+        h.update(tensor.view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()
+
+
+def log_torch_model(weights: Path):
+    """Log the nn.Module so mlflow.pytorch.load_model() returns it directly."""
+    kwargs = {}
+    if "serialization_format" in inspect.signature(mlflow.pytorch.log_model).parameters:
+        # MLflow 3 defaults to traced pt2, which needs a TensorSpec signature
+        kwargs["serialization_format"] = "pickle"
+    mlflow.pytorch.log_model(YOLO(weights).model, "model", **kwargs)
 
 
 def train():
-    """Run training and log results to MLflow."""
+    """Run training and log results to MLflow (from rank 0 only)."""
+    cfg = get_cfg()
+    trainer = None
+    if cfg.dali:  # batches are already on the GPU, USE_PREFETCHER has no effect
+        from dali_pipeline import DALIDetectionTrainer
+
+        trainer = DALIDetectionTrainer
+    elif cfg.prestack:
+        from prestacked import PrefetchPrestackedTrainer, PrestackedDetectionTrainer
+
+        trainer = PrefetchPrestackedTrainer if cfg.prefetcher else PrestackedDetectionTrainer
+    elif cfg.prefetcher:
+        from prefetcher import PrefetchDetectionTrainer
+
+        trainer = PrefetchDetectionTrainer
+
+    # DDP ranks re-import custom trainers / callback helpers by module name
+    training_dir = os.path.dirname(os.path.abspath(__file__))
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [training_dir, os.environ.get("PYTHONPATH")])
+    )
+
+    train_args = {
+        "trainer": trainer,
+        "data": cfg.data_yaml,
+        "epochs": cfg.epochs,
+        "imgsz": cfg.img_size,
+        "batch": cfg.batch,
+        "nbs": cfg.nbs,
+        "optimizer": cfg.optimizer,
+        "lr0": cfg.lr0,
+        "device": cfg.device,
+        "workers": cfg.workers,
+        # DALI decodes on the GPU; prestacked images are already decoded
+        "cache": False if cfg.dali or cfg.prestack else pick_cache_mode(cfg),
+        "project": cfg.project,
+        "name": cfg.name,
+        "exist_ok": True,
+        "amp": cfg.amp_dtype,
+        "compile": cfg.compile,  # Ultralytics falls back to eager if compile fails
+        "deterministic": False,  # deterministic cuDNN would override benchmark mode
+        "channels_last": True,   # NHWC conv weights for Tensor Cores (CUDA only)
+        "verbose": bootstrap.INTERACTIVE and RANK == 0,
+    }
+
+    if RANK != 0:
+        # Non-zero torchrun ranks just train; rank 0 owns all MLflow logging
+        return build_model(cfg).train(**train_args)
 
     mlflow.set_experiment("shelfwatch-training")
 
-    with mlflow.start_run(run_name=f"{MODEL_VARIANT}-ep{EPOCHS}"):
+    with mlflow.start_run(run_name=f"{cfg.model_variant}-ep{cfg.epochs}") as run:
+        # DDP workers spawned by Ultralytics resume this run for per-epoch metrics
+        os.environ["MLFLOW_RUN_ID"] = run.info.run_id
+
         # Log hyperparams
+        mlflow.log_params(asdict(cfg))
         mlflow.log_params({
-            "model_variant": MODEL_VARIANT,
-            "epochs": EPOCHS,
-            "img_size": IMG_SIZE,
-            "batch_size": BATCH_SIZE,
-            "data_yaml": DATA_YAML,
+            "cache": train_args["cache"],
+            "cudnn_benchmark": True,
+            "channels_last": True,
+            "deterministic": False,
+            "tf32_matmul": torch.backends.cuda.matmul.allow_tf32,
+            "tf32_cudnn": torch.backends.cudnn.allow_tf32,
         })
 
         # Train
-        model = YOLO(MODEL_VARIANT)
-        results = model.train(
-            data=DATA_YAML,
-            epochs=EPOCHS,
-            imgsz=IMG_SIZE,
-            batch=BATCH_SIZE,
-            project=PROJECT,
-            name=NAME,
-            exist_ok=True,
-            verbose=True,
-        )
+        model = build_model(cfg)
+        results = model.train(**train_args)
 
-        # Log metrics
+        # AutoBatch resolves the batch inside the trainer; accumulate as
+        # Ultralytics computes it, so loss curves read per optimizer step
+        batch_resolved = model.trainer.batch_size
+        mlflow.log_params({
+            "batch_resolved": batch_resolved,
+            "accumulate": max(round(cfg.nbs / batch_resolved), 1),
+        })
+        optimizer = getattr(model.trainer, "optimizer", None)  # not built in a DDP parent
+        if optimizer is not None:
+            mlflow.log_param("optimizer_fused", bool(optimizer.defaults.get("fused")))
+
+        # Record the effective loader setup (only built in-process, not for DDP)
+        loader = getattr(model.trainer, "train_loader", None)
+        if loader is not None:
+            mlflow.log_params({
+                "loader_workers": loader.num_workers,
+                "pin_memory": getattr(loader, "pin_memory", False),  # DALILoader has neither
+                "prefetch_factor": getattr(loader, "prefetch_factor", None),
+            })
+
+        # Log best weights as artifact + loadable MLflow model. The trainer's
+        # path, not project/name: Ultralytics nests relative projects under
+        # its own runs dir.
+        best_weights = Path(model.trainer.best)
+        if best_weights.is_file():
+            digest = weights_digest(best_weights)
+            previous = mlflow.MlflowClient().search_runs(
+                [run.info.experiment_id],
+                filter_string=f"tags.weights_blake2b = '{digest}'",
+                max_results=1,
+            )
+            if not previous:
+                mlflow.log_artifact(str(best_weights), artifact_path="weights")
+                log_torch_model(best_weights)
+                # Tag only runs that hold the upload, so lookups never land
+                # on a run that merely points elsewhere
+                mlflow.set_tag("weights_blake2b", digest)
+                print(f"✅ best.pt logged to MLflow: {best_weights}")
+            else:
+                # Identical weights already stored — point at them instead
+                source_run = previous[0].info.run_id
+                mlflow.set_tag("weights_run_id", source_run)
+                print(f"⏭️  best.pt unchanged, already logged in run {source_run}")
+
+            if cfg.export_trt:
+                # Only what Ultralytics' engine export raises (it asserts on a
+                # GPU device); any other error is a bug and fails the run
+                try:
+                    engine_path = export_engine(str(best_weights), cfg)
+                    mlflow.log_artifact(engine_path, artifact_path="engine")
+                    print(f"✅ TensorRT engine logged to MLflow: {engine_path}")
+                except (AssertionError, ImportError, OSError, RuntimeError, ValueError) as e:
+                    print(f"⚠️  TensorRT export failed, skipping engine: {e}")
+
+        # Log final metrics (DDP parents get the checkpoint's metrics dict back).
+        # Runs after the artifacts so a missing key can't cost the weights.
+        results_dict = results if isinstance(results, dict) else results.results_dict
         metrics = {
-            "mAP50": results.results_dict.get("metrics/mAP50(B)", 0),
-            "mAP50-95": results.results_dict.get("metrics/mAP50-95(B)", 0),
-            "precision": results.results_dict.get("metrics/precision(B)", 0),
-            "recall": results.results_dict.get("metrics/recall(B)", 0),
+            k.removesuffix("(B)"): results_dict[f"metrics/{k}"]
+            for k in FINAL_METRICS
+            if f"metrics/{k}" in results_dict
         }
+        if not metrics:
+            # Better a failed run than a dashboard of fake zeros
+            raise RuntimeError(f"No final metrics in training results: {sorted(results_dict)}")
         mlflow.log_metrics(metrics)
 
-        # Log best weights as artifact
-        best_weights = os.path.join(PROJECT, NAME, "weights", "best.pt")
-        if os.path.exists(best_weights):
-            mlflow.log_artifact(best_weights, artifact_path="weights")
-            print(f"✅ best.pt logged to MLflow: {best_weights}")
-
         print(f"✅ Training complete — metrics: {metrics}")
 
     return results